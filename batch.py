@@ -0,0 +1,40 @@
+"""
+Analyzes recorded sessions offline, faster than real time, and writes the
+per-frame measurements and the anomaly events of every video to CSV or Parquet.
+
+    python batch.py sessions/ --output results --format parquet --workers 8
+"""
+import argparse
+import sys
+
+from gaze_tracking.batch import BatchProcessor
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="video files or directories")
+    parser.add_argument("--output", default="results", help="directory of the result files")
+    parser.add_argument("--format", choices=BatchProcessor.FORMATS, default="csv")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, one per CPU by default")
+    parser.add_argument("--chunk-seconds", type=float, default=60)
+    parser.add_argument("--warmup-seconds", type=float, default=10)
+    parser.add_argument("--width", type=int, default=None, help="width the frames are resized to")
+    parser.add_argument("--max-faces", type=int, default=1, help="number of faces tracked at once")
+    parser.add_argument("--backend", choices=("dlib", "mediapipe"), default="dlib")
+    parser.add_argument("--statistics-mode", default="cumulative", choices=("cumulative", "ewma", "window"))
+    parser.add_argument("--no-resume", action="store_true", help="start over instead of keeping finished chunks")
+    args = parser.parse_args()
+
+    processor = BatchProcessor(args.output, fmt=args.format, chunk_seconds=args.chunk_seconds,
+                               warmup_seconds=args.warmup_seconds, workers=args.workers, width=args.width,
+                               resume=not args.no_resume, max_faces=args.max_faces,
+                               statistics_mode=args.statistics_mode, backend=args.backend)
+
+    def show(progress):
+        print("[{done}/{total}] {video} chunk {chunk}: {frames} frames, {events} events, "
+              "{realtime_factor:.1f}x real time".format(**progress))
+
+    summary = processor.run(args.inputs, progress=show)
+    print("{videos} videos ({skipped} already done), {frames} frames in {seconds:.1f}s, "
+          "{realtime_factor:.1f}x real time, {errors} frame errors".format(**summary))
+    if summary['errors']:
+        sys.exit(1)
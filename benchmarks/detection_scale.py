@@ -0,0 +1,88 @@
+"""
+Measures the latency and accuracy tradeoff of GazeTracking's detection_scale.
+
+The face detector is timed on every frame of a recording for each scale, and the
+boxes and pupil positions are compared with the ones found at full resolution.
+
+    python -m benchmarks.detection_scale video.mp4 --scales 1 0.5 0.25
+"""
+from __future__ import division
+import argparse
+import time
+
+import cv2
+import imutils
+import numpy as np
+
+from gaze_tracking import GazeTracking
+from gaze_tracking.face_tracker import FaceTracker
+
+
+def read_frames(source, width, limit):
+    """Returns the frames of the video resized like main.py does"""
+    capture = cv2.VideoCapture(source)
+    frames = []
+    while len(frames) < limit:
+        success, frame = capture.read()
+        if not success:
+            break
+        frames.append(imutils.resize(frame, width=width))
+    capture.release()
+    return frames
+
+
+def run_scale(frames, scale):
+    """Runs the detector and the whole tracker on every frame at the given scale
+
+    Returns:
+        (detection times in ms, face boxes, left pupil coordinates)
+    """
+    gaze = GazeTracking(redetect_interval=0, detection_scale=scale)
+    tracker = FaceTracker(gaze.backend._face_detector, redetect_interval=0, detection_scale=scale)
+
+    times, boxes, pupils = [], [], []
+    for frame in frames:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        start = time.perf_counter()
+        faces = tracker._detect(gray)
+        times.append((time.perf_counter() - start) * 1000)
+        boxes.append(FaceTracker._to_box(faces[0]) if faces else None)
+
+        gaze.refresh(frame)
+        pupils.append(gaze.pupil_left_coords())
+
+    return np.array(times), boxes, pupils
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="video file to analyze")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1.0, 0.5, 0.33, 0.25])
+    parser.add_argument("--width", type=int, default=1600, help="width the frames are resized to")
+    parser.add_argument("--frames", type=int, default=300, help="maximum number of frames")
+    args = parser.parse_args()
+
+    frames = read_frames(args.source, args.width, args.frames)
+    if not frames:
+        raise SystemExit("No frame could be read from {}".format(args.source))
+
+    reference = None
+    print("{:>6} {:>10} {:>10} {:>8} {:>10} {:>12}".format(
+        "scale", "p50 ms", "p95 ms", "speedup", "mean IoU", "pupil err px"))
+
+    for scale in sorted(set(args.scales), reverse=True):
+        times, boxes, pupils = run_scale(frames, scale)
+        if reference is None:
+            reference = (np.median(times), boxes, pupils)
+
+        ious = [FaceTracker.iou(a, b) for a, b in zip(reference[1], boxes) if a is not None and b is not None]
+        errors = [np.hypot(a[0] - b[0], a[1] - b[1]) for a, b in zip(reference[2], pupils)
+                  if a is not None and b is not None]
+
+        print("{:>6.2f} {:>10.2f} {:>10.2f} {:>7.1f}x {:>10.3f} {:>12.2f}".format(
+            scale, np.median(times), np.percentile(times, 95), reference[0] / np.median(times),
+            np.mean(ious) if ious else float("nan"), np.mean(errors) if errors else float("nan")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Micro-benchmark of Eye._isolate against the former full-frame masking.
+
+A synthetic eye of constant size is isolated in frames of growing size. The
+full-frame version grows with the frame, the ROI version stays flat.
+
+    python -m benchmarks.eye_isolation --repeat 500
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from gaze_tracking.eye import Eye
+
+FRAME_WIDTHS = (640, 1280, 1600, 1920, 3840)
+
+
+def full_frame_isolate(frame, region):
+    """Eye isolation as it was done before, masking the whole frame"""
+    height, width = frame.shape[:2]
+    black_frame = np.zeros((height, width), np.uint8)
+    mask = np.full((height, width), 255, np.uint8)
+    cv2.fillPoly(mask, [region], (0, 0, 0))
+    eye = cv2.bitwise_not(black_frame, frame.copy(), mask=mask)
+
+    margin = 5
+    min_x = np.min(region[:, 0]) - margin
+    max_x = np.max(region[:, 0]) + margin
+    min_y = np.min(region[:, 1]) - margin
+    max_y = np.max(region[:, 1]) + margin
+    return eye[min_y:max_y, min_x:max_x]
+
+
+def synthetic_landmarks(width, height):
+    """Returns a (68, 2) landmark array with a 40x20 left eye in the middle of the frame"""
+    landmarks = np.zeros((68, 2), np.int32)
+    cx, cy = width // 2, height // 2
+    landmarks[Eye.LEFT_EYE_POINTS] = [(cx - 20, cy), (cx - 8, cy - 9), (cx + 8, cy - 9),
+                                      (cx + 20, cy), (cx + 8, cy + 8), (cx - 8, cy + 8)]
+    return landmarks
+
+
+def measure(function, repeat):
+    """Returns the median duration of the function in microseconds"""
+    durations = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations[i] = time.perf_counter() - start
+    return np.median(durations) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=300)
+    args = parser.parse_args()
+
+    print("{:>12} {:>14} {:>12} {:>8}".format("frame", "full-frame us", "ROI us", "speedup"))
+    for width in FRAME_WIDTHS:
+        height = width * 9 // 16
+        frame = np.random.randint(0, 255, (height, width), np.uint8)
+        landmarks = synthetic_landmarks(width, height)
+        eye = Eye.__new__(Eye)
+
+        reference = full_frame_isolate(frame, landmarks[Eye.LEFT_EYE_POINTS])
+        eye._isolate(frame, landmarks, Eye.LEFT_EYE_POINTS)
+        assert np.array_equal(reference, eye.frame)
+
+        before = measure(lambda: full_frame_isolate(frame, landmarks[Eye.LEFT_EYE_POINTS]), args.repeat)
+        after = measure(lambda: eye._isolate(frame, landmarks, Eye.LEFT_EYE_POINTS), args.repeat)
+        print("{:>12} {:>14.1f} {:>12.1f} {:>7.1f}x".format(
+            "{}x{}".format(width, height), before, after, before / after))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Compares the HeadPoseEstimator with the former per-frame head pose code
+(cold solvePnP, 8 projectPoints calls, angles in pure Python) on a simulated
+head turning slowly in front of the camera, with noisy landmarks.
+
+Reports the latency per frame and the jitter, i.e. the standard deviation of
+the frame-to-frame change of the head pose angles.
+
+    python -m benchmarks.head_pose --frames 3000 --noise 1.0
+"""
+from __future__ import division
+import argparse
+import math
+import time
+
+import cv2
+import numpy as np
+
+from gaze_tracking.head_pose import HeadPoseEstimator
+
+WIDTH, HEIGHT = 1600, 900
+
+
+def simulated_landmarks(nb_frames, noise, seed=0):
+    """Returns the (nb_frames, 6, 2) image points of a head slowly turning left and right"""
+    rng = np.random.default_rng(seed)
+    camera = np.array([[WIDTH, 0, WIDTH / 2], [0, WIDTH, HEIGHT / 2], [0, 0, 1]], dtype="double")
+    points = np.empty((nb_frames, 6, 2))
+    for index in range(nb_frames):
+        phase = index / 90
+        rotation = np.array([0.15 * math.sin(phase / 2), 0.4 * math.sin(phase), 0.05 + 0.05 * math.cos(phase)])
+        translation = np.array([30 * math.sin(phase / 3), -20.0, 2500.0])
+        projected, _ = cv2.projectPoints(HeadPoseEstimator.MODEL_POINTS, rotation, translation, camera, np.zeros(4))
+        points[index] = projected.reshape(-1, 2)
+    return points + rng.normal(0, noise, points.shape)
+
+
+def former_head_pose(image_points):
+    """Head pose angles computed the way GazeTracking did before HeadPoseEstimator"""
+    model_points = np.array(HeadPoseEstimator.MODEL_POINTS)
+    camera_matrix = np.array([[WIDTH, 0, WIDTH / 2], [0, WIDTH, HEIGHT / 2], [0, 0, 1]], dtype="double")
+    dist_coeffs = np.zeros((4, 1))
+    _, rotation_vector, translation_vector = cv2.solvePnP(model_points, image_points, camera_matrix, dist_coeffs,
+                                                          flags=cv2.SOLVEPNP_ITERATIVE)
+    corners = []
+    for point in HeadPoseEstimator.BOX_POINTS:
+        projected, _ = cv2.projectPoints(np.array([point]), rotation_vector, translation_vector,
+                                         camera_matrix, dist_coeffs)
+        corners.append((int(projected[0][0][0]), int(projected[0][0][1])))
+
+    angles = []
+    for inner, outer in zip(corners[:4], corners[4:]):
+        angles.append(math.sqrt((inner[0] - outer[0]) ** 2 + (inner[1] - outer[1]) ** 2))
+        angles.append(math.atan2(inner[1] - outer[1], inner[0] - outer[0]) * 180 / math.pi)
+    return angles
+
+
+def run(name, function, landmarks):
+    times, angles = [], []
+    for image_points in landmarks:
+        start = time.perf_counter()
+        angles.append(function(image_points))
+        times.append(time.perf_counter() - start)
+    times = np.array(times) * 1e6
+    steps = np.diff(np.array(angles), axis=0)
+    steps[:, 1::2] = (steps[:, 1::2] + 180) % 360 - 180  # angles wrap around at +-180
+    jitter = steps.std(axis=0)
+    print("{:>12} {:>10.1f} {:>10.1f} {:>14.3f} {:>14.3f}".format(
+        name, np.median(times), np.percentile(times, 95), jitter[0::2].mean(), jitter[1::2].mean()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=3000)
+    parser.add_argument("--noise", type=float, default=1.0, help="landmark noise in pixels")
+    args = parser.parse_args()
+
+    landmarks = simulated_landmarks(args.frames, args.noise)
+    shape = (HEIGHT, WIDTH)
+
+    def estimator_run(warm_start):
+        estimator = HeadPoseEstimator(warm_start=warm_start)
+
+        def estimate(image_points):
+            estimator.estimate(image_points, shape)
+            return estimator.box_angles(estimator.box())
+        return estimate
+
+    print("{:>12} {:>10} {:>10} {:>14} {:>14}".format("", "p50 us", "p95 us", "length jitter", "angle jitter"))
+    run("former", former_head_pose, landmarks)
+    run("cold", estimator_run(False), landmarks)
+    run("warm start", estimator_run(True), landmarks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Compares the landmark backends of GazeTracking on the same recording:
+    dlib             HOG detector, 68 landmarks and threshold based pupils
+    dlib+facemesh    the former debug path of main.py: dlib, plus a second
+                     face model (FaceMesh) for the gaze lines
+    mediapipe        FaceMesh only, the iris landmarks give the pupils
+
+For each one, the latency per frame, the share of frames with a face and
+with located pupils, and the distance between its pupils and the dlib ones.
+
+    python -m benchmarks.landmark_backends video.mp4 --frames 600
+"""
+from __future__ import division
+import argparse
+import time
+
+import cv2
+import imutils
+import numpy as np
+
+from gaze_tracking import GazeTracking
+
+
+def read_frames(source, width, limit):
+    """Returns the frames of the video resized like main.py does"""
+    capture = cv2.VideoCapture(source)
+    frames = []
+    while len(frames) < limit:
+        success, frame = capture.read()
+        if not success:
+            break
+        frames.append(imutils.resize(frame, width=width))
+    capture.release()
+    return frames
+
+
+def run(frames, backend, face_mesh=False):
+    """Analyzes every frame with the given backend
+
+    Returns:
+        (latencies in ms, list of (left pupil, right pupil) or None per frame, frames with a face)
+    """
+    gaze = GazeTracking(backend=backend, headless=True)
+    mesh = None
+    if face_mesh:
+        import mediapipe as mp
+        mesh = mp.solutions.face_mesh.FaceMesh(max_num_faces=1, refine_landmarks=True)
+
+    times, pupils, faces = [], [], 0
+    for index, frame in enumerate(frames):
+        start = time.perf_counter()
+        if mesh is not None:
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            mesh.process(rgb)
+            cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+        gaze.refresh(frame, index / 30)
+        times.append((time.perf_counter() - start) * 1000)
+
+        faces += bool(gaze.located_faces)
+        pupils.append((gaze.pupil_left_coords(), gaze.pupil_right_coords()) if gaze.pupils_located else None)
+
+    if mesh is not None:
+        mesh.close()
+    return np.array(times), pupils, faces
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="video file to analyze")
+    parser.add_argument("--width", type=int, default=1600, help="width the frames are resized to")
+    parser.add_argument("--frames", type=int, default=600, help="maximum number of frames")
+    args = parser.parse_args()
+
+    frames = read_frames(args.source, args.width, args.frames)
+    if not frames:
+        raise SystemExit("No frame could be read from {}".format(args.source))
+
+    reference = None
+    print("{:>14} {:>8} {:>8} {:>8} {:>8} {:>13}".format(
+        "backend", "p50 ms", "p95 ms", "faces", "pupils", "vs dlib px"))
+    for name, backend, face_mesh in (("dlib", "dlib", False), ("dlib+facemesh", "dlib", True),
+                                     ("mediapipe", "mediapipe", False)):
+        times, pupils, faces = run(frames, backend, face_mesh)
+        if reference is None:
+            reference = pupils
+
+        distances = [np.hypot(a[side][0] - b[side][0], a[side][1] - b[side][1])
+                     for a, b in zip(reference, pupils) if a is not None and b is not None for side in (0, 1)]
+        print("{:>14} {:>8.1f} {:>8.1f} {:>7.0%} {:>7.0%} {:>13}".format(
+            name, np.median(times), np.percentile(times, 95), faces / len(frames),
+            sum(p is not None for p in pupils) / len(frames),
+            "{:.1f}".format(np.mean(distances)) if distances else "-"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Measures the frames per second of MultiStreamEngine against the number of
+worker processes. The same video is analyzed as several independent streams.
+
+    python -m benchmarks.multistream video.mp4 --streams 8 --workers 1 2 4 8
+"""
+from __future__ import division
+import argparse
+import time
+
+from gaze_tracking.multistream import MultiStreamEngine
+
+
+def run(source, nb_streams, workers, width):
+    """Analyzes nb_streams copies of the source and returns (frames, seconds)"""
+    engine = MultiStreamEngine([source] * nb_streams, workers=workers, width=width)
+    start = time.perf_counter()
+    with engine:
+        for _ in engine.messages():
+            pass
+    return sum(engine.nb_results.values()), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="video file replayed by every stream")
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--width", type=int, default=None, help="width the frames are resized to")
+    args = parser.parse_args()
+
+    baseline = None
+    print("{:>8} {:>10} {:>10} {:>10} {:>12}".format("workers", "frames", "seconds", "fps", "efficiency"))
+    for workers in args.workers:
+        frames, seconds = run(args.source, args.streams, workers, args.width)
+        fps = frames / seconds
+        if baseline is None:
+            baseline = fps / workers
+        print("{:>8} {:>10} {:>10.2f} {:>10.1f} {:>11.0%}".format(
+            workers, frames, seconds, fps, fps / (baseline * workers)))
+
+
+if __name__ == "__main__":
+    main()
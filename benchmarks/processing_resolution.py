@@ -0,0 +1,101 @@
+"""
+Measures what the processing resolution costs and changes, on a recorded clip.
+
+    former      the frame upscaled to 1600 pixels wide, then analyzed and drawn
+                at that size, like main.py and test.py used to do
+    native      analyzed at the size of the video
+    <width>     downscaled to that width for the analysis (--widths)
+
+Every setting draws into a display buffer of --display-width, so the
+end-to-end time covers the resize, the analysis and the drawing. The pupil
+error is the distance, in pixels of the video, between the pupils found at
+this setting and the ones of the former setting.
+
+    python -m benchmarks.processing_resolution video.mp4 --widths 480 320
+"""
+from __future__ import division
+import argparse
+import time
+
+import cv2
+import imutils
+import numpy as np
+
+from gaze_tracking import GazeTracking
+
+FORMER_WIDTH = 1600
+
+
+def read_frames(source, limit):
+    capture = cv2.VideoCapture(source)
+    frames = []
+    while len(frames) < limit:
+        success, frame = capture.read()
+        if not success:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+def run(frames, backend, processing_width, display_width, upscale):
+    """Analyzes the frames at one setting
+
+    Returns:
+        (latencies in ms, (n, 2, 2) pupils in pixels of the video, NaN when not located)
+    """
+    gaze = GazeTracking(backend=backend, processing_width=processing_width)
+    display = None
+    times = []
+    pupils = np.full((len(frames), 2, 2), np.nan)
+    for index, frame in enumerate(frames):
+        start = time.perf_counter()
+        if upscale:
+            frame = imutils.resize(frame, width=FORMER_WIDTH)
+        gaze.refresh(frame, index / 30)
+        display = gaze.display_buffer(display_width, display)
+        gaze.annotated_frame(out=display)
+        times.append((time.perf_counter() - start) * 1000)
+
+        if gaze.pupils_located:
+            scale = frames[index].shape[1] / gaze.processing_shape[1]
+            pupils[index] = np.array([gaze.pupil_left_coords(), gaze.pupil_right_coords()]) * scale
+    return np.array(times), pupils
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="video file to analyze")
+    parser.add_argument("--frames", type=int, default=300, help="maximum number of frames")
+    parser.add_argument("--widths", type=int, nargs="*", default=[480, 320], help="processing widths to compare")
+    parser.add_argument("--display-width", type=int, default=FORMER_WIDTH, help="width of the display buffer")
+    parser.add_argument("--backend", choices=("dlib", "mediapipe"), default="dlib")
+    args = parser.parse_args()
+
+    frames = read_frames(args.source, args.frames)
+    if not frames:
+        raise SystemExit("No frame could be read from {}".format(args.source))
+
+    settings = [("former", None, True), ("native", None, False)]
+    settings += [(str(width), width, False) for width in args.widths if width < frames[0].shape[1]]
+
+    print("video {}x{}, {} frames".format(frames[0].shape[1], frames[0].shape[0], len(frames)))
+    print("{:>8} {:>8} {:>8} {:>8} {:>8} {:>14} {:>14}".format(
+        "setting", "p50 ms", "p95 ms", "speedup", "pupils", "error p50 px", "error p95 px"))
+    reference, reference_time = None, None
+    for name, width, upscale in settings:
+        times, pupils = run(frames, args.backend, width, args.display_width, upscale)
+        if reference is None:
+            reference, reference_time = pupils, np.median(times)
+
+        errors = np.linalg.norm(pupils - reference, axis=2).ravel()
+        errors = errors[~np.isnan(errors)]
+        located = (~np.isnan(pupils[:, 0, 0])).mean()
+        print("{:>8} {:>8.1f} {:>8.1f} {:>7.1f}x {:>7.0%} {:>14} {:>14}".format(
+            name, np.median(times), np.percentile(times, 95), reference_time / np.median(times), located,
+            "{:.2f}".format(np.median(errors)) if len(errors) else "-",
+            "{:.2f}".format(np.percentile(errors, 95)) if len(errors) else "-"))
+
+
+if __name__ == "__main__":
+    main()
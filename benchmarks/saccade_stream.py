@@ -0,0 +1,60 @@
+"""
+Feeds a simulated gaze stream to the SaccadeDetector and reports the
+per-sample latency for each hour of the stream. The latency and the
+memory must stay flat however long the session is. The memory is the
+one still allocated by gaze_tracking/saccades.py, the buffers of the
+benchmark itself are left out.
+
+    python -m benchmarks.saccade_stream --hours 8 --fps 30
+"""
+from __future__ import division
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from gaze_tracking import saccades
+from gaze_tracking.saccades import SaccadeDetector
+
+
+def simulated_gaze(nb_samples, fps, seed=0):
+    """Returns timestamps and positions of a fixating gaze with a saccade every ~2 seconds"""
+    rng = np.random.default_rng(seed)
+    timestamps = np.arange(nb_samples) / fps + rng.normal(0, 0.002, nb_samples)
+    timestamps = np.maximum.accumulate(timestamps)
+    jumps = (rng.random(nb_samples) < 1 / (2 * fps)) * rng.normal(0, 80, (2, nb_samples))
+    positions = np.cumsum(jumps, axis=1).T + rng.normal(0, 0.3, (nb_samples, 2)) + 800
+    return timestamps, positions
+
+
+def detector_memory():
+    """Returns the memory in KiB allocated by saccades.py and not freed yet"""
+    snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(True, saccades.__file__)])
+    return sum(statistic.size for statistic in snapshot.statistics('filename')) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", type=float, default=8)
+    parser.add_argument("--fps", type=float, default=30)
+    args = parser.parse_args()
+
+    samples_per_hour = int(3600 * args.fps)
+    timestamps, positions = simulated_gaze(int(samples_per_hour * args.hours), args.fps)
+    tracemalloc.start()
+    detector = SaccadeDetector()  # its own buffers are counted
+    print("{:>5} {:>12} {:>12} {:>10} {:>12}".format("hour", "mean us", "p99 us", "saccades", "memory KiB"))
+    for hour, start in enumerate(range(0, len(timestamps), samples_per_hour)):
+        durations = np.empty(min(samples_per_hour, len(timestamps) - start))
+        for i in range(len(durations)):
+            begin = time.perf_counter()
+            detector.update(positions[start + i], timestamps[start + i])
+            durations[i] = time.perf_counter() - begin
+        memory = detector_memory()
+        print("{:>5} {:>12.2f} {:>12.2f} {:>10} {:>12.1f}".format(
+            hour + 1, durations.mean() * 1e6, np.percentile(durations, 99) * 1e6, detector.nb_saccades, memory))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+"""
+Per-stage benchmark of GazeTracking.refresh and annotated_frame, reproducible
+without a webcam.
+
+By default the frames are generated: a drawn face whose eyes look around and
+jump from time to time, with its 68 landmarks known exactly. They are given to
+GazeTracking through a landmark backend returning these landmarks, so every
+stage after the landmarks runs as in production. When dlib and its model are
+available, the HOG detector and the shape predictor are timed on the same
+frames. With --source, the frames of a video are analyzed by the dlib or
+mediapipe backend instead.
+
+Stages, timed inside refresh by wrapping the functions that implement them
+(a stage includes the stages it calls, e.g. update_averages includes
+head_pose_angle and detect_saccades):
+    grayscale           _preprocess: downscale to the processing width and grayscale
+    hog_detect          dlib HOG face detector
+    shape_predictor     dlib 68 landmarks predictor
+    landmarks           LandmarkBackend.detect of a real backend (--source), detection included
+    eye_isolate         Eye._isolate
+    calibration         Calibration.evaluate / refine
+    pupil_detect_iris   Pupil.detect_iris
+    head_pose           HeadPoseEstimator.estimate and box (solvePnP, projectPoints)
+    update_averages     FaceState._update_averages
+    detect_saccades     FaceState.detect_saccades
+    annotated_frame     GazeTracking.annotated_frame
+    refresh             the whole GazeTracking.refresh
+
+For each stage: p50/p95/p99 and mean in ms, calls per frame, and the peak
+memory allocated by one call (tracemalloc, measured in a separate pass so
+that it does not slow down the timings). --output saves the results as JSON,
+--compare prints the change against a previous JSON file.
+
+    python -m benchmarks.stages --frames 300 --output stages.json
+    python -m benchmarks.stages --frames 300 --compare stages.json
+"""
+from __future__ import division
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from gaze_tracking import GazeTracking
+from gaze_tracking.calibration import Calibration
+from gaze_tracking.eye import Eye
+from gaze_tracking.face_state import FaceState
+from gaze_tracking.head_pose import HeadPoseEstimator
+from gaze_tracking.landmarks import LandmarkBackend, DlibBackend
+from gaze_tracking.pupil import Pupil
+
+STAGES = ("grayscale", "hog_detect", "shape_predictor", "landmarks", "eye_isolate", "calibration", "pupil_detect_iris",
+          "head_pose", "update_averages", "detect_saccades", "annotated_frame", "refresh")
+
+
+def _eye_contour(center, half_width, half_height, outer_first):
+    """Returns the 6 landmarks of an eye: outer corner, two upper points, inner corner, two lower points"""
+    x, y = center
+    points = [(-1, 0), (-0.35, -1), (0.35, -1), (1, 0), (0.35, 0.9), (-0.35, 0.9)]
+    if not outer_first:
+        points = [(-px, py) for px, py in points]
+        points = points[3:4] + points[2:0:-1] + points[0:1] + points[5:3:-1]
+    return [(x + px * half_width, y + py * half_height) for px, py in points]
+
+
+def synthetic_face(width=640, height=480, nb_frames=300, seed=0):
+    """Returns a list of (BGR frame, (68, 2) int32 landmarks) of a drawn face
+    moving slightly, whose eyes look around and jump every 45 frames
+    """
+    rng = np.random.default_rng(seed)
+    background = rng.normal(120, 12, (height, width, 3)).clip(0, 255).astype(np.uint8)
+    samples = []
+    target = np.zeros(2)
+    for index in range(nb_frames):
+        if index % 45 == 0:
+            target = rng.uniform(-1, 1, 2) * (0.45, 0.25)
+        gaze = target + 0.05 * np.array([math.sin(index / 7), math.cos(index / 9)])
+
+        face_width = 0.35 * width
+        cx = width / 2 + 6 * math.sin(index / 40)
+        cy = height / 2 + 4 * math.cos(index / 50)
+        a, b = face_width / 2, face_width * 0.65
+
+        landmarks = np.zeros((68, 2))
+        t = np.pi - np.arange(17) * np.pi / 16
+        landmarks[0:17] = np.stack((cx + a * np.cos(t), cy + 0.1 * b + 0.9 * b * np.sin(t)), axis=1)
+
+        eye_y = cy - 0.12 * b
+        half_width, half_height = 0.09 * face_width, 0.045 * face_width
+        left_eye, right_eye = (cx - 0.22 * face_width, eye_y), (cx + 0.22 * face_width, eye_y)
+        landmarks[36:42] = _eye_contour(left_eye, half_width, half_height, True)
+        landmarks[42:48] = _eye_contour(right_eye, half_width, half_height, False)
+        for start, center in ((17, left_eye), (22, right_eye)):
+            xs = center[0] + np.linspace(-1.2, 1.2, 5) * half_width
+            landmarks[start:start + 5] = np.stack((xs, eye_y - 2.2 * half_height - 3 * np.cos(np.linspace(-1, 1, 5))),
+                                                  axis=1)
+
+        landmarks[27:31] = [(cx, eye_y + k * 0.1 * b) for k in range(4)]
+        landmarks[31:36] = [(cx + k * 0.04 * face_width, cy + 0.28 * b - abs(k) * 2) for k in range(-2, 3)]
+
+        mouth_y, mouth_width = cy + 0.55 * b, 0.2 * face_width
+        t = np.linspace(np.pi, -np.pi, 13)[:12]
+        landmarks[48:60] = np.stack((cx + mouth_width * np.cos(t), mouth_y - 0.25 * mouth_width * np.sin(t)), axis=1)
+        t = np.linspace(np.pi, -np.pi, 9)[:8]
+        landmarks[60:68] = np.stack((cx + 0.8 * mouth_width * np.cos(t), mouth_y - 0.1 * mouth_width * np.sin(t)),
+                                    axis=1)
+        landmarks = landmarks.round().astype(np.int32)
+
+        frame = background.copy()
+        cv2.ellipse(frame, (int(cx), int(cy)), (int(a), int(b)), 0, 0, 360, (150, 170, 210), -1)
+        eyes = frame.copy()
+        for points, center in ((landmarks[36:42], left_eye), (landmarks[42:48], right_eye)):
+            cv2.fillPoly(eyes, [points], (235, 235, 235))
+            iris = (int(center[0] + gaze[0] * half_width), int(center[1] + gaze[1] * half_height))
+            cv2.circle(eyes, iris, int(half_height * 0.9), (70, 50, 40), -1)
+            cv2.circle(eyes, iris, int(half_height * 0.4), (15, 15, 15), -1)
+        mask = np.zeros((height, width), np.uint8)
+        cv2.fillPoly(mask, [landmarks[36:42], landmarks[42:48]], 255)
+        cv2.copyTo(eyes, mask, frame)
+        cv2.polylines(frame, [landmarks[17:22], landmarks[22:27], landmarks[27:31], landmarks[31:36]], False,
+                      (90, 100, 130), 2)
+        cv2.polylines(frame, [landmarks[48:60]], True, (80, 80, 160), 2)
+        samples.append((frame, landmarks))
+    return samples
+
+
+class SyntheticBackend(LandmarkBackend):
+    """Backend returning the landmarks the synthetic frames were drawn with"""
+
+    LEFT_EYE_POINTS = DlibBackend.LEFT_EYE_POINTS
+    RIGHT_EYE_POINTS = DlibBackend.RIGHT_EYE_POINTS
+    HEAD_POSE_POINTS = DlibBackend.HEAD_POSE_POINTS
+
+    def __init__(self):
+        super(SyntheticBackend, self).__init__(max_faces=1)
+        self.landmarks = None
+        self.frame_width = None
+
+    def detect(self, frame, gray):
+        if self.landmarks is None:
+            return []
+        scale = gray.shape[1] / self.frame_width
+        return [(0, None, (self.landmarks * scale).astype(np.int32))]
+
+    def active_tracks(self):
+        return {0}
+
+
+class StageTimer(object):
+    """Records the durations and the allocations of the wrapped functions, by stage"""
+
+    def __init__(self):
+        self.durations = {}
+        self.allocations = {}
+        self.measure_allocations = None  # stage whose allocations are measured
+
+    def _call(self, stage, function, args, kwargs):
+        if self.measure_allocations is not None:
+            if stage != self.measure_allocations:
+                return function(*args, **kwargs)
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            result = function(*args, **kwargs)
+            self.allocations.setdefault(stage, []).append(tracemalloc.get_traced_memory()[1] - before)
+            return result
+
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.durations.setdefault(stage, []).append(time.perf_counter() - start)
+        return result
+
+    @contextlib.contextmanager
+    def wrap(self, owner, name, stage):
+        """Times the calls of owner.name, a class or an instance attribute, as the stage
+        until the end of the block
+        """
+        original = getattr(owner, name)
+
+        def wrapper(*args, **kwargs):
+            return self._call(stage, original, args, kwargs)
+
+        setattr(owner, name, wrapper)
+        try:
+            yield
+        finally:
+            setattr(owner, name, original)
+
+
+def dlib_functions():
+    """Returns (HOG detector, shape predictor), each None if not available"""
+    try:
+        import dlib
+        detector = dlib.get_frontal_face_detector()
+    except (ImportError, AttributeError, RuntimeError):
+        return None, None
+    model = os.path.join(os.path.dirname(os.path.abspath(sys.modules[DlibBackend.__module__].__file__)),
+                         "trained_models", "shape_predictor_68_face_landmarks.dat")
+    try:
+        predictor = dlib.shape_predictor(model) if os.path.exists(model) else None
+    except RuntimeError:
+        predictor = None
+    return detector, predictor
+
+
+def run(samples, gaze, timer, backend, detector, predictor, display_width):
+    """Analyzes every frame with the stage wrappers in place"""
+    wrappers = [
+        (GazeTracking, '_preprocess', 'grayscale'),
+        (Eye, '_isolate', 'eye_isolate'),
+        (Calibration, 'evaluate', 'calibration'),
+        (Calibration, 'refine', 'calibration'),
+        (Pupil, 'detect_iris', 'pupil_detect_iris'),
+        (HeadPoseEstimator, 'estimate', 'head_pose'),
+        (HeadPoseEstimator, 'box', 'head_pose'),
+        (FaceState, '_update_averages', 'update_averages'),
+        (FaceState, 'detect_saccades', 'detect_saccades'),
+        (GazeTracking, 'annotated_frame', 'annotated_frame'),
+        (GazeTracking, 'refresh', 'refresh'),
+    ]
+    if not isinstance(gaze.backend, SyntheticBackend):
+        wrappers.append((gaze.backend, 'detect', 'landmarks'))
+    if isinstance(gaze.backend, DlibBackend):
+        wrappers.append((gaze.backend._face_tracker, '_detector', 'hog_detect'))
+        wrappers.append((gaze.backend, '_predictor', 'shape_predictor'))
+
+    display = None
+    with contextlib.ExitStack() as stack:
+        for owner, name, stage in wrappers:
+            stack.enter_context(timer.wrap(owner, name, stage))
+
+        for index, (frame, landmarks) in enumerate(samples):
+            if isinstance(backend, SyntheticBackend):
+                backend.landmarks = landmarks
+                backend.frame_width = frame.shape[1]
+            gaze.refresh(frame, index / 30)
+            display = gaze.display_buffer(display_width, display)
+            gaze.annotated_frame(out=display)
+
+            # Not in the refresh of the synthetic backend, timed on the same frames
+            if detector is not None and not isinstance(gaze.backend, DlibBackend):
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                timer._call('hog_detect', detector, (gray, 0), {})
+                if predictor is not None:
+                    import dlib
+                    x, y, w, h = cv2.boundingRect(landmarks)
+                    timer._call('shape_predictor', predictor, (gray, dlib.rectangle(x, y, x + w, y + h)), {})
+
+
+def summarize(timer, nb_frames, warmup):
+    results = {}
+    for stage in STAGES:
+        durations = timer.durations.get(stage)
+        if not durations:
+            continue
+        calls = len(durations)
+        # Leave out the first frames, when the calibration and the caches are filled
+        skip = int(round(warmup * calls / nb_frames))
+        values = np.array(durations[skip:] or durations) * 1000
+        allocations = timer.allocations.get(stage)
+        results[stage] = {
+            'p50_ms': float(np.percentile(values, 50)),
+            'p95_ms': float(np.percentile(values, 95)),
+            'p99_ms': float(np.percentile(values, 99)),
+            'mean_ms': float(values.mean()),
+            'calls_per_frame': calls / nb_frames,
+            'alloc_peak_bytes': int(np.median(allocations)) if allocations else None,
+        }
+    return results
+
+
+def environment(args, samples):
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'machine': platform.machine(),
+        'source': args.source or "synthetic",
+        'frame_size': [int(samples[0][0].shape[1]), int(samples[0][0].shape[0])],
+        'frames': len(samples),
+        'processing_width': args.processing_width,
+        'display_width': args.display_width,
+    }
+
+
+def print_results(results, baseline=None):
+    header = "{:>18} {:>9} {:>9} {:>9} {:>7} {:>11}".format("stage", "p50 ms", "p95 ms", "p99 ms", "calls", "alloc KiB")
+    if baseline is not None:
+        header += " {:>11}".format("p50 change")
+    print(header)
+    for stage, result in results.items():
+        alloc = result['alloc_peak_bytes']
+        line = "{:>18} {:>9.3f} {:>9.3f} {:>9.3f} {:>7.2f} {:>11}".format(
+            stage, result['p50_ms'], result['p95_ms'], result['p99_ms'], result['calls_per_frame'],
+            "-" if alloc is None else "{:.1f}".format(alloc / 1024))
+        if baseline is not None:
+            before = baseline.get(stage)
+            line += " {:>11}".format("{:+.1%}".format(result['p50_ms'] / before['p50_ms'] - 1)
+                                     if before and before['p50_ms'] else "-")
+        print(line)
+
+
+def read_video(source, limit):
+    capture = cv2.VideoCapture(source)
+    samples = []
+    while len(samples) < limit:
+        success, frame = capture.read()
+        if not success:
+            break
+        samples.append((frame, None))
+    capture.release()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", help="video file, synthetic frames if not given")
+    parser.add_argument("--backend", choices=("dlib", "mediapipe"), default="dlib",
+                        help="landmark backend used with --source")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--width", type=int, default=640, help="width of the synthetic frames")
+    parser.add_argument("--height", type=int, default=480, help="height of the synthetic frames")
+    parser.add_argument("--processing-width", type=int, default=None)
+    parser.add_argument("--display-width", type=int, default=None, help="width of the annotated frames")
+    parser.add_argument("--warmup", type=int, default=30, help="first frames left out of the statistics")
+    parser.add_argument("--output", help="JSON file to save the results to")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare with")
+    args = parser.parse_args()
+
+    if args.source:
+        samples = read_video(args.source, args.frames)
+        if not samples:
+            raise SystemExit("No frame could be read from {}".format(args.source))
+        backend = args.backend
+        detector = predictor = None
+    else:
+        samples = synthetic_face(args.width, args.height, args.frames)
+        backend = SyntheticBackend()
+        detector, predictor = dlib_functions()
+
+    def new_gaze():
+        return GazeTracking(backend=backend, processing_width=args.processing_width)
+
+    # Timings
+    timer = StageTimer()
+    run(samples, new_gaze(), timer, backend, detector, predictor, args.display_width)
+
+    # Allocations, one stage at a time so that the wrappers of the other stages don't count
+    tracemalloc.start()
+    try:
+        for stage in STAGES:
+            if stage not in timer.durations:
+                continue
+            timer.measure_allocations = stage
+            if isinstance(backend, LandmarkBackend):
+                backend.reset()
+            allocation_samples = samples[:max(args.warmup + 20, len(samples) // 5)]
+            run(allocation_samples, new_gaze(), timer, backend, detector, predictor, args.display_width)
+    finally:
+        tracemalloc.stop()
+        timer.measure_allocations = None
+
+    results = summarize(timer, len(samples), args.warmup)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)['stages']
+
+    env = environment(args, samples)
+    print("{} frames {}x{}, commit {}".format(env['source'], env['frame_size'][0], env['frame_size'][1],
+                                              env['commit']))
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'environment': env, 'stages': results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,9 @@
 from .gaze_tracking import GazeTracking
+from .profiles import CalibrationProfiles
+from .log_sink import LogSink
+from .capture import FrameCapture
+from .pipeline import GazePipeline
+from .multistream import MultiStreamEngine
+from .broadcast import FrameBroadcaster
+from .event_index import EventIndex
+from .instrumentation import Instrumentation
@@ -0,0 +1,358 @@
+from __future__ import division
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from collections import namedtuple
+
+import cv2
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.webm', '.m4v')
+
+# (name, type) of the columns of the output tables
+FRAME_COLUMNS = [
+    ('frame', 'int'), ('time', 'float'), ('face_id', 'int'), ('face', 'bool'),
+    ('pupil_left_x', 'float'), ('pupil_left_y', 'float'), ('pupil_right_x', 'float'), ('pupil_right_y', 'float'),
+    ('horizontal_ratio', 'float'), ('vertical_ratio', 'float'), ('blinking', 'bool'),
+] + [('head_pose_{}'.format(index), 'float') for index in range(8)]
+EVENT_COLUMNS = [
+    ('frame', 'int'), ('time', 'float'), ('face_id', 'int'), ('case', 'str'), ('type', 'str'), ('info', 'str'),
+]
+
+Chunk = namedtuple('Chunk', ['path', 'name', 'index', 'start', 'stop', 'warmup_start', 'fps'])
+
+
+def find_videos(inputs):
+    """Returns the (path, name) of the video files given directly or found in the given
+    directories, sorted by path. The name, without extension, is the path relative to the
+    directory given, or the file name for a file given directly. Names that would still
+    be shared by several videos get a short hash of the absolute path.
+
+    Arguments:
+        inputs (list): Paths of video files or of directories searched recursively
+    """
+    videos = {}
+    for path in inputs:
+        if os.path.isdir(path):
+            for directory, _, files in os.walk(path):
+                for file_name in files:
+                    if file_name.lower().endswith(VIDEO_EXTENSIONS):
+                        video = os.path.join(directory, file_name)
+                        videos[video] = os.path.splitext(os.path.relpath(video, path))[0]
+        else:
+            videos[path] = os.path.splitext(os.path.basename(path))[0]
+
+    counts = {}
+    for name in videos.values():
+        counts[name] = counts.get(name, 0) + 1
+    for path, name in videos.items():
+        if counts[name] > 1:
+            digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]
+            videos[path] = "{}-{}".format(name, digest)
+    return sorted(videos.items())
+
+
+def plan_chunks(path, chunk_seconds, warmup_seconds, name=None):
+    """Splits a video into chunks of chunk_seconds. Each chunk starts being
+    analyzed warmup_seconds before its first frame, so that the tracker, the
+    calibration and the averages are warm when its rows start being written.
+    The last chunk runs until the end of the file, the frame count of the
+    container is not always exact.
+
+    Arguments:
+        path (str): Video file
+        chunk_seconds (float): Duration of a chunk
+        warmup_seconds (float): Duration analyzed before each chunk and not written
+        name (str): Name of the outputs of the video, see find_videos, the file name if None
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise IOError("Cannot open video {}".format(path))
+    nb_frames = max(int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), 1)
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    capture.release()
+    chunk_frames = max(int(chunk_seconds * fps), 1)
+    warmup_frames = int(warmup_seconds * fps)
+
+    if name is None:
+        name = os.path.splitext(os.path.basename(path))[0]
+    starts = list(range(0, nb_frames, chunk_frames))
+    return [Chunk(path, name, index, start, starts[index + 1] if index + 1 < len(starts) else None,
+                  max(start - warmup_frames, 0), fps)
+            for index, start in enumerate(starts)]
+
+
+def write_table(path, columns, rows, fmt):
+    """Writes the rows to a CSV or Parquet file, the file only appears once complete"""
+    temporary = path + ".tmp"
+    if fmt == "csv":
+        with open(temporary, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow([name for name, _ in columns])
+            writer.writerows(rows)
+    else:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        types = {'int': pa.int64(), 'float': pa.float64(), 'bool': pa.bool_(), 'str': pa.string()}
+        schema = pa.schema([(name, types[kind]) for name, kind in columns])
+        data = {name: [row[index] for row in rows] for index, (name, _) in enumerate(columns)}
+        pq.write_table(pa.Table.from_pydict(data, schema=schema), temporary)
+    os.replace(temporary, path)
+
+
+def merge_tables(parts, path, fmt):
+    """Concatenates the chunk files of a video, in order, into a single file"""
+    temporary = path + ".tmp"
+    if fmt == "csv":
+        with open(temporary, 'w', newline='') as output:
+            for index, part in enumerate(parts):
+                with open(part, 'r', newline='') as file:
+                    header = file.readline()
+                    if index == 0:
+                        output.write(header)
+                    shutil.copyfileobj(file, output)
+    else:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        pq.write_table(pa.concat_tables([pq.read_table(part) for part in parts]), temporary)
+    os.replace(temporary, path)
+
+
+# State of a worker process, the models are loaded once per process
+_worker = {}
+
+
+def _init_worker(gaze_options, width):
+    from .gaze_tracking import GazeTracking
+    _worker['width'] = width
+    # Raised by the first chunk: a failing initializer makes the pool respawn workers forever
+    try:
+        _worker['gaze'] = GazeTracking(headless=True, **gaze_options)
+    except Exception as error:
+        _worker['error'] = "Cannot create the tracker of a worker: {!r}".format(error)
+
+
+def _frame_rows(index, timestamp, gaze):
+    """Returns one row per face found in the frame, or a single row without a face"""
+    rows = []
+    for metrics in gaze.face_metrics() or [gaze.metrics()]:
+        pupil_left = metrics['pupil_left'] or (None, None)
+        pupil_right = metrics['pupil_right'] or (None, None)
+        head_pose = metrics['head_pose_angle'] or [None] * 8
+        rows.append([index, timestamp, metrics['face_id'], metrics['face'],
+                     pupil_left[0], pupil_left[1], pupil_right[0], pupil_right[1],
+                     metrics['horizontal_ratio'], metrics['vertical_ratio'], metrics['blinking']] + list(head_pose))
+    return rows
+
+
+def _process_chunk(task):
+    """Analyzes a chunk in a worker and writes its frame and event tables
+
+    Returns:
+        (chunk, number of frames written, number of events, seconds, number of frames that failed)
+    """
+    from .log_sink import _to_json
+    chunk, parts_dir, fmt = task
+    if 'error' in _worker:
+        raise RuntimeError(_worker['error'])
+    gaze, width = _worker['gaze'], _worker['width']
+    start_time = time.perf_counter()
+
+    gaze.reset()
+    events = gaze.events.subscribe()
+    capture = cv2.VideoCapture(chunk.path)
+    if chunk.warmup_start:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, chunk.warmup_start)
+
+    frame_rows, event_rows, errors = [], [], 0
+    index = chunk.warmup_start
+    while chunk.stop is None or index < chunk.stop:
+        success, frame = capture.read()
+        if not success:
+            break
+        if width:
+            frame = cv2.resize(frame, (width, int(frame.shape[0] * width / frame.shape[1])),
+                               interpolation=cv2.INTER_AREA)
+
+        # Video time, so that velocities don't depend on the processing speed
+        timestamp = index / chunk.fps
+        try:
+            gaze.refresh(frame, timestamp)
+        except Exception:
+            errors += 1
+            index += 1
+            continue
+
+        new_events = events.poll()
+        if index >= chunk.start:
+            frame_rows.extend(_frame_rows(index, timestamp, gaze))
+            event_rows.extend([index, timestamp, event.face, event.case.label, event.case.type,
+                               json.dumps(event.info, default=_to_json)] for event in new_events)
+        index += 1
+
+    capture.release()
+    events.close()
+
+    extension = "." + fmt
+    write_table(os.path.join(parts_dir, "events-{:05d}{}".format(chunk.index, extension)),
+                EVENT_COLUMNS, event_rows, fmt)
+    # Written last, its presence marks the chunk as done
+    write_table(os.path.join(parts_dir, "frames-{:05d}{}".format(chunk.index, extension)),
+                FRAME_COLUMNS, frame_rows, fmt)
+    return chunk, max(index - chunk.start, 0), len(event_rows), time.perf_counter() - start_time, errors
+
+
+class BatchProcessor(object):
+    """
+    This class analyzes recorded videos offline, without display or annotation.
+    Every video is split into chunks analyzed in parallel by a pool of worker
+    processes. For each video it writes <name>.frames.<fmt> (one row per frame
+    and face: pupils, ratios, blinking, head pose) and <name>.events.<fmt>
+    (one row per anomaly event), where the name is the path of the video
+    relative to the directory given, see find_videos: the output directory
+    mirrors the input tree.
+
+    A chunk starts warmup_seconds early, the rows of the overlap are not
+    written: with the "window" statistics mode and a warm-up longer than the
+    window, the averages are the ones a single pass would give, the other
+    modes converge during the warm-up. With several faces, the face ids are
+    only consistent within a chunk.
+
+    Finished chunks are kept in <output_dir>/.parts until their video is
+    complete, so an interrupted run starts again from the missing chunks.
+    """
+
+    FORMATS = ("csv", "parquet")
+
+    def __init__(self, output_dir, fmt="csv", chunk_seconds=60, warmup_seconds=10, workers=None,
+                 width=None, resume=True, **gaze_options):
+        """
+        Arguments:
+            output_dir (str): Directory of the result files
+            fmt (str): "csv" or "parquet" (needs pyarrow)
+            chunk_seconds (float): Duration of video analyzed by a worker at once
+            warmup_seconds (float): Duration analyzed before each chunk and not written
+            workers (int): Number of worker processes, one per CPU if None
+            width (int): Frames are resized to this width before the analysis, if set
+            resume (bool): Keep the chunks and the videos already done by a previous run
+            gaze_options: Keyword arguments given to every GazeTracking
+        """
+        if fmt not in self.FORMATS:
+            raise ValueError("fmt must be one of {}".format(self.FORMATS))
+        if fmt == "parquet":
+            try:
+                import pyarrow.parquet  # noqa: F401
+            except ImportError:
+                raise ImportError("The parquet format needs pyarrow")
+
+        self.output_dir = output_dir
+        self.fmt = fmt
+        self.chunk_seconds = chunk_seconds
+        self.warmup_seconds = warmup_seconds
+        self.workers = workers or multiprocessing.cpu_count()
+        self.width = width
+        self.resume = resume
+        self.gaze_options = gaze_options
+
+    def outputs(self, name):
+        """Returns the paths of the frame and event tables of a video"""
+        return (os.path.join(self.output_dir, "{}.frames.{}".format(name, self.fmt)),
+                os.path.join(self.output_dir, "{}.events.{}".format(name, self.fmt)))
+
+    def _parts_dir(self, name):
+        return os.path.join(self.output_dir, ".parts", name)
+
+    def _merge(self, chunks):
+        name = chunks[0].name
+        parts_dir = self._parts_dir(name)
+        frames_path, events_path = self.outputs(name)
+        os.makedirs(os.path.dirname(frames_path), exist_ok=True)
+        for kind, path in (("events", events_path), ("frames", frames_path)):
+            parts = [os.path.join(parts_dir, "{}-{:05d}.{}".format(kind, chunk.index, self.fmt)) for chunk in chunks]
+            merge_tables(parts, path, self.fmt)
+        shutil.rmtree(parts_dir)
+        # Empty directories of the name, up to .parts itself
+        directory = os.path.dirname(parts_dir)
+        while os.path.normpath(directory) != os.path.normpath(self.output_dir):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+    def run(self, inputs, progress=None):
+        """Analyzes every video and returns a summary of the run
+
+        Arguments:
+            inputs (list): Video files or directories
+            progress (callable): Called with a dict after every chunk
+        """
+        start_time = time.perf_counter()
+        chunks_of = {}
+        tasks = []
+        skipped = 0
+        for path, name in find_videos(inputs):
+            # Checked first, a finished video is not opened again
+            if self.resume and all(os.path.exists(output) for output in self.outputs(name)):
+                skipped += 1
+                continue
+            chunks = plan_chunks(path, self.chunk_seconds, self.warmup_seconds, name)
+
+            parts_dir = self._parts_dir(name)
+            if not self.resume and os.path.exists(parts_dir):
+                shutil.rmtree(parts_dir)
+            os.makedirs(parts_dir, exist_ok=True)
+
+            chunks_of[path] = chunks
+            for chunk in chunks:
+                done = os.path.join(parts_dir, "frames-{:05d}.{}".format(chunk.index, self.fmt))
+                if not os.path.exists(done):
+                    tasks.append((chunk, parts_dir, self.fmt))
+
+        remaining = {path: sum(1 for task in tasks if task[0].path == path) for path in chunks_of}
+        for path, count in remaining.items():
+            if not count:
+                self._merge(chunks_of[path])
+
+        nb_frames = 0
+        video_seconds = 0.0
+        errors = 0
+        if tasks:
+            workers = max(1, min(self.workers, len(tasks)))
+            with multiprocessing.Pool(workers, initializer=_init_worker,
+                                      initargs=(self.gaze_options, self.width)) as pool:
+                for done, result in enumerate(pool.imap_unordered(_process_chunk, tasks), 1):
+                    chunk, frames, events, seconds, chunk_errors = result
+                    nb_frames += frames
+                    video_seconds += frames / chunk.fps
+                    errors += chunk_errors
+
+                    remaining[chunk.path] -= 1
+                    if not remaining[chunk.path]:
+                        self._merge(chunks_of[chunk.path])
+
+                    if progress is not None:
+                        progress({
+                            'done': done,
+                            'total': len(tasks),
+                            'video': chunk.path,
+                            'chunk': chunk.index,
+                            'frames': frames,
+                            'events': events,
+                            'realtime_factor': frames / chunk.fps / seconds if seconds else 0.0,
+                        })
+
+        elapsed = time.perf_counter() - start_time
+        return {
+            'videos': len(chunks_of),
+            'skipped': skipped,
+            'chunks': len(tasks),
+            'frames': nb_frames,
+            'errors': errors,
+            'seconds': elapsed,
+            'video_seconds': video_seconds,
+            'realtime_factor': video_seconds / elapsed if elapsed else 0.0,
+        }
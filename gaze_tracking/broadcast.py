@@ -0,0 +1,292 @@
+from __future__ import division
+import itertools
+import json
+import logging
+import threading
+import time
+
+import cv2
+
+from .log_sink import _to_json
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastClient(object):
+    """Counters of one viewer of a FrameBroadcaster"""
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.connected = time.monotonic()
+        self.last_seq = -1
+        self.nb_sent = 0
+        self.nb_skipped = 0
+        self.nb_bytes = 0
+
+    def stats(self):
+        elapsed = time.monotonic() - self.connected
+        return {
+            'sent': self.nb_sent,
+            'skipped': self.nb_skipped,
+            'bytes': self.nb_bytes,
+            'bytes_per_second': self.nb_bytes / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+def _rounded(value, digits):
+    """Rounds a float or the floats of a sequence, keeps None"""
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return [round(item, digits) for item in value]
+    return round(value, digits)
+
+
+class FrameBroadcaster(object):
+    """
+    This class streams the annotated frames of a GazeTracking to any number
+    of viewers. A single background loop reads the capture, analyzes the
+    frame, draws it and encodes it to JPEG once, then every viewer is sent
+    the same bytes.
+
+    Only the newest encoded frame is kept: a viewer too slow to take every
+    frame skips to the newest one instead of slowing down the loop or the
+    other viewers. The skipped frames are counted per viewer.
+
+    Clients that only need the numbers read metrics_stream(): Server-Sent
+    Events carrying a compact JSON sample per frame and the anomaly events.
+    The frames are only drawn and encoded while a video viewer is connected.
+    A frame whose analysis or encoding fails is logged, counted and skipped.
+    """
+
+    BOUNDARY = b"frame"
+
+    def __init__(self, gaze, capture, width=None, quality=80):
+        """
+        Arguments:
+            gaze (GazeTracking): Tracker to run, it must not be refreshed elsewhere meanwhile
+            capture (FrameCapture): Started source of the frames
+            width (int): Width of the streamed frames, None keeps the captured size. The analysis
+                runs at the processing resolution of the tracker, see GazeTracking.processing_width
+            quality (int): JPEG quality, from 0 to 100
+        """
+        self.gaze = gaze
+        self.capture = capture
+        self.width = width
+        self.quality = quality
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._condition = threading.Condition()
+        self._latest = None  # (seq, multipart chunk)
+        self._sample = None  # (seq, server-sent event)
+        self._seq = 0
+        self._ids = itertools.count()
+        self.clients = {}
+        self.metric_clients = {}
+        self.running = False
+
+        self.nb_encoded = 0
+        self.nb_bytes = 0
+        self.nb_errors = 0
+        self.last_error = None
+        self._started = None
+
+    def start(self):
+        """Starts the capture, analysis and encoding loop"""
+        self._started = time.monotonic()
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name="FrameBroadcaster", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the loop, the streams of the viewers end"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        display = None
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        try:
+            while not self._stop.is_set():
+                captured = self.capture.read()
+                if captured is None:
+                    if not self.capture.running:
+                        break
+                    continue
+
+                frame = captured.frame
+                frame.flags.writeable = False
+
+                try:
+                    self.gaze.refresh(frame, captured.timestamp)
+                    sample = self._event(None, self.sample())
+
+                    chunk = None
+                    if self.clients:
+                        display = self.gaze.display_buffer(self.width, display)
+                        frame = self.gaze.annotated_frame(out=display)
+
+                        success, buffer = cv2.imencode('.jpg', frame, params)
+                        if success:
+                            chunk = b"".join((b"--", self.BOUNDARY, b"\r\nContent-Type: image/jpeg\r\n\r\n",
+                                              buffer.tobytes(), b"\r\n"))
+                except Exception as error:
+                    # The viewers keep the previous frame, the loop goes on with the next one
+                    logger.exception("Frame %d of the broadcaster failed", captured.seq)
+                    self.nb_errors += 1
+                    self.last_error = repr(error)
+                    continue
+
+                with self._condition:
+                    if chunk is not None:
+                        self._latest = (self._seq, chunk)
+                        self.nb_encoded += 1
+                    self._sample = (self._seq, sample)
+                    self._seq += 1
+                    self._condition.notify_all()
+        finally:
+            with self._condition:
+                self.running = False
+                self._condition.notify_all()
+
+    def stream(self, timeout=1.0):
+        """Generator of the multipart chunks of one viewer, for a
+        multipart/x-mixed-replace response with BOUNDARY as boundary.
+        Ends when the broadcaster stops.
+
+        Arguments:
+            timeout (float): Time in seconds between two checks that the broadcaster still runs
+        """
+        with self._condition:
+            client = BroadcastClient(next(self._ids))
+            self.clients[client.client_id] = client
+        try:
+            while True:
+                with self._condition:
+                    self._condition.wait_for(
+                        lambda: not self.running or (self._latest is not None and self._latest[0] != client.last_seq),
+                        timeout)
+                    if not self.running:
+                        return
+                    if self._latest is None or self._latest[0] == client.last_seq:
+                        continue
+                    seq, chunk = self._latest
+                    self.nb_bytes += len(chunk)
+
+                if client.last_seq >= 0:
+                    client.nb_skipped += seq - client.last_seq - 1
+                client.last_seq = seq
+                client.nb_sent += 1
+                client.nb_bytes += len(chunk)
+                # Blocks as long as this viewer takes, the loop keeps going meanwhile
+                yield chunk
+        finally:
+            with self._condition:
+                del self.clients[client.client_id]
+
+    def sample(self):
+        """Returns the gaze sample of the last analyzed frame sent by metrics_stream,
+        with the values rounded to what is meaningful for a display
+        """
+        faces = []
+        for metrics in self.gaze.face_metrics():
+            faces.append({
+                'id': metrics['face_id'],
+                'pupil_left': _rounded(metrics['pupil_left'], 1),
+                'pupil_right': _rounded(metrics['pupil_right'], 1),
+                'horizontal_ratio': _rounded(metrics['horizontal_ratio'], 3),
+                'vertical_ratio': _rounded(metrics['vertical_ratio'], 3),
+                'blinking': metrics['blinking'],
+                'head_pose_angle': _rounded(metrics['head_pose_angle'], 1),
+            })
+        return {'frame': self._seq, 'timestamp': _rounded(self.gaze.timestamp, 3), 'faces': faces}
+
+    @staticmethod
+    def _event(name, data):
+        """Encodes a server-sent event with compact JSON data"""
+        data = json.dumps(data, separators=(',', ':'), default=_to_json).encode()
+        if name is None:
+            return b"data: " + data + b"\n\n"
+        return b"event: " + name.encode() + b"\ndata: " + data + b"\n\n"
+
+    def metrics_stream(self, rate=None, events=True, timeout=1.0):
+        """Generator of the server-sent events of one client, for a text/event-stream
+        response. Each gaze sample is a "message" event, see sample(), and each anomaly
+        an "anomaly" event, see AnomalyEvent.to_dict. Ends when the broadcaster stops.
+
+        Arguments:
+            rate (float): Maximal number of samples per second, every frame if None
+            events (bool): Also send the anomaly events
+            timeout (float): Time in seconds without data after which a comment is sent,
+                so that a closed connection is noticed
+        """
+        period = 1 / rate if rate else 0
+        subscription = self.gaze.events.subscribe() if events else None
+        with self._condition:
+            client = BroadcastClient(next(self._ids))
+            self.metric_clients[client.client_id] = client
+        last_time = None
+        try:
+            while True:
+                with self._condition:
+                    self._condition.wait_for(
+                        lambda: not self.running or (self._sample is not None and self._sample[0] != client.last_seq),
+                        timeout)
+                    if not self.running:
+                        return
+                    latest = self._sample
+
+                messages = []
+                if subscription is not None:
+                    messages.extend(self._event("anomaly", event.to_dict()) for event in subscription.poll())
+                new_sample = latest is not None and latest[0] != client.last_seq
+                if new_sample:
+                    seq, sample = latest
+                    if client.last_seq >= 0:
+                        client.nb_skipped += seq - client.last_seq - 1
+                    client.last_seq = seq
+                    now = time.monotonic()
+                    if last_time is None or now - last_time >= period:
+                        last_time = now
+                        client.nb_sent += 1
+                        messages.append(sample)
+                    else:
+                        client.nb_skipped += 1
+                if not messages:
+                    if new_sample:  # sample left out by the decimation
+                        continue
+                    messages.append(b": keepalive\n\n")
+
+                data = b"".join(messages)
+                client.nb_bytes += len(data)
+                with self._condition:
+                    self.nb_bytes += len(data)
+                yield data
+        finally:
+            if subscription is not None:
+                subscription.close()
+            with self._condition:
+                del self.metric_clients[client.client_id]
+
+    def stats(self):
+        """Returns the number of frames encoded and failed, and the bandwidth used in total and by each client"""
+        elapsed = time.monotonic() - self._started if self._started is not None else 0
+        with self._condition:
+            clients = {client_id: client.stats() for client_id, client in self.clients.items()}
+            metric_clients = {client_id: client.stats() for client_id, client in self.metric_clients.items()}
+            nb_bytes = self.nb_bytes
+        return {
+            'frames': self._seq,
+            'encoded': self.nb_encoded,
+            'errors': self.nb_errors,
+            'last_error': self.last_error,
+            'bytes': nb_bytes,
+            'bytes_per_second': nb_bytes / elapsed if elapsed > 0 else 0.0,
+            'clients': clients,
+            'metric_clients': metric_clients,
+            'running': self.running,
+        }
@@ -1,5 +1,6 @@
 from __future__ import division
 import cv2
+import numpy as np
 from .pupil import Pupil
 
 
@@ -9,11 +10,26 @@ class Calibration(object):
     best binarization threshold value for the person and the webcam.
     """
 
-    def __init__(self):
+    # Candidate binarization thresholds and expected share of the iris in the eye frame
+    THRESHOLDS = np.arange(5, 100, 5)
+    AVERAGE_IRIS_SIZE = 0.48
+
+    def __init__(self, refine_interval=0):
+        """
+        Arguments:
+            refine_interval (int): Once the calibration is complete, the threshold of one
+                frame out of refine_interval is evaluated to follow slow changes (0 disables it)
+        """
         self.nb_frames = 20
         self.thresholds_left = []
         self.thresholds_right = []
 
+        self.refine_interval = refine_interval
+        self.drift_tolerance = 10
+        self.max_drifts = 3
+        self._refine_counters = [0, 0]
+        self._drifts = [0, 0]
+
     def is_complete(self):
         """Returns true if the calibration is completed"""
         return len(self.thresholds_left) >= self.nb_frames and len(self.thresholds_right) >= self.nb_frames
@@ -48,18 +64,19 @@ class Calibration(object):
         """Calculates the optimal threshold to binarize the
         frame for the given eye.
 
+        The frame is filtered once, then the iris size for every candidate
+        threshold is read from the cumulative histogram: a pixel is black
+        after binarization when its value is lower or equal to the threshold.
+
         Argument:
             eye_frame (numpy.ndarray): Frame of the eye to be analyzed
         """
-        average_iris_size = 0.48
-        trials = {}
+        frame = Pupil.smoothing(eye_frame)[5:-5, 5:-5]
+        histogram = np.bincount(frame.ravel(), minlength=256)
+        iris_sizes = np.cumsum(histogram)[Calibration.THRESHOLDS] / frame.size
 
-        for threshold in range(5, 100, 5):
-            iris_frame = Pupil.image_processing(eye_frame, threshold)
-            trials[threshold] = Calibration.iris_size(iris_frame)
-
-        best_threshold, iris_size = min(trials.items(), key=(lambda p: abs(p[1] - average_iris_size)))
-        return best_threshold
+        best = np.argmin(np.abs(iris_sizes - Calibration.AVERAGE_IRIS_SIZE))
+        return int(Calibration.THRESHOLDS[best])
 
     def evaluate(self, eye_frame, side):
         """Improves calibration by taking into consideration the
@@ -72,6 +89,59 @@ class Calibration(object):
         threshold = self.find_best_threshold(eye_frame)
 
         if side == 0:
-            self.thresholds_left.append(threshold)
+            thresholds = self.thresholds_left
         elif side == 1:
-            self.thresholds_right.append(threshold)
+            thresholds = self.thresholds_right
+        else:
+            return
+
+        # An eye already calibrated keeps being evaluated while the other one recalibrates
+        thresholds.append(threshold)
+        del thresholds[:-self.nb_frames]
+
+    def load(self, thresholds_left, thresholds_right):
+        """Starts from the thresholds found in a previous session,
+        the calibration is complete right away.
+
+        Arguments:
+            thresholds_left (list): Thresholds of the left eye
+            thresholds_right (list): Thresholds of the right eye
+        """
+        self.thresholds_left = [int(t) for t in thresholds_left][-self.nb_frames:]
+        self.thresholds_right = [int(t) for t in thresholds_right][-self.nb_frames:]
+        self._refine_counters = [0, 0]
+        self._drifts = [0, 0]
+
+    def refine(self, eye_frame, side):
+        """Keeps a completed calibration up to date. Every refine_interval frames,
+        the best threshold of the frame replaces the oldest one. When it drifts
+        away from the current threshold max_drifts times in a row, the thresholds
+        of this eye are dropped and the full calibration runs again, starting from
+        the threshold of this frame.
+
+        Arguments:
+            eye_frame (numpy.ndarray): Frame of the eye
+            side: Indicates whether it's the left eye (0) or the right eye (1)
+        """
+        if self.refine_interval <= 0 or side not in (0, 1):
+            return
+
+        self._refine_counters[side] += 1
+        if self._refine_counters[side] < self.refine_interval:
+            return
+        self._refine_counters[side] = 0
+
+        threshold = self.find_best_threshold(eye_frame)
+        thresholds = self.thresholds_left if side == 0 else self.thresholds_right
+
+        if abs(threshold - self.threshold(side)) > self.drift_tolerance:
+            self._drifts[side] += 1
+            if self._drifts[side] >= self.max_drifts:
+                self._drifts[side] = 0
+                thresholds[:] = [threshold]
+                return
+        else:
+            self._drifts[side] = 0
+
+        thresholds.append(threshold)
+        del thresholds[:-self.nb_frames]
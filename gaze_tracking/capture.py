@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+
+CapturedFrame = namedtuple('CapturedFrame', ['frame', 'timestamp', 'seq'])
+
+
+class FrameCapture(object):
+    """
+    This class reads a camera (or a video file) in a producer thread and
+    only keeps the newest frame. The consumer always gets the freshest
+    frame, and frames it was too slow to take are counted as dropped
+    instead of piling up in the driver buffer.
+    """
+
+    def __init__(self, source=0, realtime=None, loop=False):
+        """
+        Arguments:
+            source (int or str): Camera index, or path of a video file to replay
+            realtime (bool): For files, replay at the file frame rate and drop frames like a camera
+                would (True), or wait for the consumer and deliver every frame (False).
+                Defaults to True for cameras and False for files.
+            loop (bool): Restart a video file when it ends
+        """
+        self.source = source
+        self.is_file = isinstance(source, str)
+        self.realtime = (not self.is_file) if realtime is None else realtime
+        self.loop = loop
+
+        self._capture = None
+        self._thread = None
+        self._condition = threading.Condition()
+        self._latest = None
+        self._last_read_seq = -1
+        self._stop = threading.Event()
+        self.running = False
+
+        self.nb_captured = 0
+        self.nb_read = 0
+        self.nb_dropped = 0
+
+    def start(self):
+        """Opens the source and starts the producer thread"""
+        self._capture = cv2.VideoCapture(self.source)
+        if not self._capture.isOpened():
+            raise IOError("Cannot open video source {}".format(self.source))
+
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name="FrameCapture", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the producer thread and releases the source"""
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def fps(self):
+        """Frame rate announced by the source (0 if unknown)"""
+        return self._capture.get(cv2.CAP_PROP_FPS) if self._capture is not None else 0
+
+    def _run(self):
+        period = 1 / self.fps if self.is_file and self.realtime and self.fps > 0 else 0
+        next_time = time.monotonic()
+        seq = 0
+
+        while not self._stop.is_set():
+            success, frame = self._capture.read()
+            if not success:
+                if self.is_file and self.loop:
+                    self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                break
+
+            if period:
+                next_time += period
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            with self._condition:
+                if not self.realtime:
+                    # Replay without losing frames: wait for the consumer
+                    while self._has_new_frame() and not self._stop.is_set():
+                        self._condition.wait(0.1)
+                elif self._has_new_frame():
+                    self.nb_dropped += 1
+
+                self._latest = CapturedFrame(frame, time.monotonic(), seq)
+                self.nb_captured += 1
+                self._condition.notify_all()
+            seq += 1
+
+        self._capture.release()
+        with self._condition:
+            self.running = False
+            self._condition.notify_all()
+
+    def read(self, timeout=1.0):
+        """Returns the newest frame not read yet as a CapturedFrame, waiting for it if needed.
+        Returns None if no new frame arrived before the timeout or if the source has ended.
+
+        Arguments:
+            timeout (float): Maximal waiting time in seconds, 0 never waits
+        """
+        with self._condition:
+            if timeout:
+                self._condition.wait_for(lambda: self._has_new_frame() or not self.running, timeout)
+            if not self._has_new_frame():
+                return None
+            self._last_read_seq = self._latest.seq
+            self.nb_read += 1
+            self._condition.notify_all()
+            return self._latest
+
+    def latest(self):
+        """Returns the newest frame, even if it was already read, without waiting"""
+        return self._latest
+
+    def _has_new_frame(self):
+        return self._latest is not None and self._latest.seq != self._last_read_seq
+
+    def stats(self):
+        """Returns the number of frames captured, read and dropped"""
+        return {
+            'captured': self.nb_captured,
+            'read': self.nb_read,
+            'dropped': self.nb_dropped,
+            'running': self.running,
+        }
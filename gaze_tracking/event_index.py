@@ -0,0 +1,214 @@
+import heapq
+import threading
+from bisect import bisect_left, bisect_right
+
+from .events import EventCase
+
+
+class EventIndex(object):
+    """
+    This class keeps the anomaly events of an EventBus for queries, without
+    consuming them for the other subscribers. The events are indexed by
+    case, time and frame number, and read by pages with a cursor: the
+    sequence number of the next event to return.
+
+    Events are published in time order, so the time (and, with a single
+    face, the frame number) ranges are found by bisection. When an event
+    goes back in time (a video starting over), the range falls back to a
+    scan. A background thread indexes the new events before the bus
+    overwrites them, queries also index the ones still pending.
+    """
+
+    CASES = {case.label: case for case in EventCase}
+
+    def __init__(self, bus, capacity=100000, interval=0.1):
+        """
+        Arguments:
+            bus (events.EventBus): Bus to index, its events still in the buffer are indexed too
+            capacity (int): Maximal number of events kept, the oldest ones are forgotten first
+            interval (float): Time in seconds between two indexing passes of the thread
+        """
+        self.capacity = capacity
+        self.interval = interval
+        self._subscription = bus.subscribe(from_start=True)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Lists in sequence order, the entry of absolute index i is at i - _offset
+        self._offset = 0
+        self._start = 0  # entries before it are forgotten, removed by _compact
+        self._events = []
+        self._seqs = []
+        self._timestamps = []
+        self._frames = []
+        # Absolute indexes of the events of each case
+        self._by_case = {case: [] for case in EventCase}
+        self._time_ordered = True
+        self._frame_ordered = True
+
+    def start(self):
+        """Starts the indexing thread"""
+        self._thread = threading.Thread(target=self._run, name="EventIndex", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the indexing thread and stops following the bus"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._subscription.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def __len__(self):
+        with self._lock:
+            self._sync()
+            return len(self._events) - self._start
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                self._sync()
+
+    def _sync(self):
+        """Indexes the events published since the last call"""
+        for event in self._subscription.poll():
+            timestamp = event.timestamp if event.timestamp is not None else 0.0
+            frame = event.frame if event.frame is not None else 0
+            if self._timestamps and timestamp < self._timestamps[-1]:
+                self._time_ordered = False
+            if self._frames and frame < self._frames[-1]:
+                self._frame_ordered = False
+
+            self._by_case[event.case].append(self._offset + len(self._events))
+            self._events.append(event)
+            self._seqs.append(event.seq)
+            self._timestamps.append(timestamp)
+            self._frames.append(frame)
+
+        if len(self._events) - self._start > self.capacity:
+            self._start = len(self._events) - self.capacity
+            if self._start > self.capacity:
+                self._compact()
+
+    def _compact(self):
+        """Removes the forgotten events from the lists, once there are as many as kept ones"""
+        start = self._start
+        del self._events[:start], self._seqs[:start], self._timestamps[:start], self._frames[:start]
+        self._offset += start
+        for indexes in self._by_case.values():
+            del indexes[:bisect_left(indexes, self._offset)]
+        self._start = 0
+        self._time_ordered = all(a <= b for a, b in zip(self._timestamps, self._timestamps[1:]))
+        self._frame_ordered = all(a <= b for a, b in zip(self._frames, self._frames[1:]))
+
+    @classmethod
+    def parse_case(cls, case):
+        """Returns the EventCase of a case or of its label ("pupil position", "saccade"...)"""
+        if isinstance(case, EventCase):
+            return case
+        if case not in cls.CASES:
+            raise ValueError("Unknown case {}, expected one of {}".format(case, sorted(cls.CASES)))
+        return cls.CASES[case]
+
+    def query(self, cursor=None, limit=100, cases=None, since=None, until=None, frame_from=None, frame_to=None,
+              face=None):
+        """Returns a page of events, oldest first, as a dict:
+            events: the AnomalyEvent matching every given filter
+            next_cursor: cursor to pass to read the following page
+            has_more: whether more matching events were already there
+
+        Arguments:
+            cursor (int): Sequence number of the first event to consider, the oldest kept if None
+            limit (int): Maximal number of events returned
+            cases (list): Cases to keep, EventCase or labels, all if None
+            since (float): Smallest timestamp, in the clock given to GazeTracking.refresh
+            until (float): Largest timestamp
+            frame_from (int): Smallest frame number
+            frame_to (int): Largest frame number
+            face (int): Track id of the face
+        """
+        cases = None if cases is None else {self.parse_case(case) for case in cases}
+
+        with self._lock:
+            self._sync()
+
+            low, high = self._start, len(self._events)
+            if cursor is not None:
+                low = bisect_left(self._seqs, cursor, low, high)
+            if self._time_ordered:
+                low, high = self._narrow(self._timestamps, low, high, since, until)
+            if self._frame_ordered:
+                low, high = self._narrow(self._frames, low, high, frame_from, frame_to)
+
+            if cases is None:
+                positions = range(low, high)
+            else:
+                positions = self._case_positions(cases, low, high)
+
+            events = []
+            has_more = False
+            next_position = high
+            for position in positions:
+                if not self._matches(position, since, until, frame_from, frame_to, face):
+                    continue
+                if len(events) == limit:
+                    has_more = True
+                    next_position = position
+                    break
+                events.append(self._events[position])
+
+            if next_position < len(self._seqs):
+                next_cursor = self._seqs[next_position]
+            elif self._seqs:
+                next_cursor = self._seqs[-1] + 1
+            else:
+                next_cursor = cursor or 0
+            return {'events': events, 'next_cursor': next_cursor, 'has_more': has_more}
+
+    @staticmethod
+    def _narrow(keys, low, high, smallest, largest):
+        """Restricts [low, high) to the positions whose sorted keys are in the range"""
+        if smallest is not None:
+            low = bisect_left(keys, smallest, low, high)
+        if largest is not None:
+            high = bisect_right(keys, largest, low, high)
+        return low, high
+
+    def _case_positions(self, cases, low, high):
+        """Yields the positions in [low, high) of the events of the given cases, in order"""
+        first, last = self._offset + low, self._offset + high
+        ranges = []
+        for case in cases:
+            indexes = self._by_case[case]
+            bounds = range(bisect_left(indexes, first), bisect_left(indexes, last))
+            ranges.append(map(indexes.__getitem__, bounds))
+        for index in heapq.merge(*ranges):
+            yield index - self._offset
+
+    def _matches(self, position, since, until, frame_from, frame_to, face):
+        """Checks the filters the bisection could not apply"""
+        if not self._time_ordered:
+            timestamp = self._timestamps[position]
+            if (since is not None and timestamp < since) or (until is not None and timestamp > until):
+                return False
+        if not self._frame_ordered:
+            frame = self._frames[position]
+            if (frame_from is not None and frame < frame_from) or (frame_to is not None and frame > frame_to):
+                return False
+        return face is None or self._events[position].face == face
+
+    def stats(self):
+        """Returns the number of events kept and the number lost before they were indexed"""
+        with self._lock:
+            return {
+                'events': len(self._events) - self._start,
+                'lost': self._subscription.dropped,
+            }
@@ -0,0 +1,224 @@
+import threading
+import time
+from enum import IntEnum
+
+
+class EventCase(IntEnum):
+    """What an anomaly event is about"""
+    PUPIL_POSITION = 0
+    HORIZONTAL_RATIO = 1
+    VERTICAL_RATIO = 2
+    HEAD_POSE_ANGLE = 3
+    SACCADE = 4
+
+    @property
+    def label(self):
+        return self.name.lower().replace('_', ' ')
+
+    @property
+    def type(self):
+        return "saccade" if self is EventCase.SACCADE else "deviation"
+
+
+class AnomalyEvent(object):
+    """
+    Compact record of an anomaly. The timestamp comes from the monotonic
+    clock, wall_time from time.time() and is only used for display. face is
+    the track id of the face the anomaly comes from.
+
+    The measurements are kept as one flat tuple of values, described by a
+    layout shared by every event of the same kind: (key, number of values)
+    pairs. The info dict is only built when it is read.
+    """
+
+    __slots__ = ('seq', 'frame', 'timestamp', 'wall_time', 'case', 'layout', 'values', 'face')
+
+    # Layouts of the values of every kind of event
+    PUPIL_LEFT_INFO = (('avg_left_pupil_pos', 2), ('pupil_left_coords', 2),
+                       ('deviation_left_x', 1), ('deviation_left_y', 1))
+    PUPIL_RIGHT_INFO = (('avg_pupil_right_coords', 2), ('pupil_right_coords', 2),
+                        ('deviation_right_x', 1), ('deviation_right_y', 1))
+    HORIZONTAL_RATIO_INFO = (('avg_horizontal_ratio', 1), ('horizontal_ratio', 1), ('deviation_horizontal', 1))
+    VERTICAL_RATIO_INFO = (('avg_vertical_ratio', 1), ('vertical_ratio', 1), ('deviation_vertical', 1))
+    HEAD_POSE_ANGLE_INFO = (('avg_head_pose_angle', 8), ('head_pose_angle', 8), ('deviation_angle', 1))
+    SACCADE_ONSET_INFO = (('phase', 1), ('timestamp', 1), ('position', 2), ('velocity', 1),
+                          ('middle_coordinate', 2), ('saccade_threshold', 1))
+    SACCADE_OFFSET_INFO = (('phase', 1), ('timestamp', 1), ('position', 2), ('onset_position', 2),
+                           ('duration', 1), ('amplitude', 1), ('peak_velocity', 1),
+                           ('middle_coordinate', 2), ('saccade_threshold', 1))
+
+    def __init__(self, frame, timestamp, case, layout, values, face=None):
+        """
+        Arguments:
+            frame (int): Number of the frame of the face
+            timestamp (float): Time of the frame
+            case (EventCase): What the anomaly is about
+            layout (tuple): (key, number of values) pairs, e.g. PUPIL_LEFT_INFO
+            values (tuple): Values in the order of the layout, flattened
+            face (int): Track id of the face
+        """
+        self.seq = -1
+        self.frame = frame
+        self.timestamp = timestamp
+        self.wall_time = time.time()
+        self.case = case
+        self.layout = layout
+        self.values = values
+        self.face = face
+
+    @property
+    def info(self):
+        """Returns the measurements as a dict, a value or a tuple of values by key"""
+        info = {}
+        index = 0
+        for key, size in self.layout:
+            info[key] = self.values[index] if size == 1 else self.values[index:index + size]
+            index += size
+        return info
+
+    def to_dict(self):
+        """Returns the event in the format of the log file"""
+        return {
+            'seq': self.seq,
+            'frame': self.frame,
+            'face': self.face,
+            'timestamp': time.ctime(self.wall_time),
+            'case': self.case.label,
+            'type': self.case.type,
+            'info': self.info
+        }
+
+    def __repr__(self):
+        return "AnomalyEvent(seq={}, frame={}, face={}, case={})".format(self.seq, self.frame, self.face,
+                                                                          self.case.label)
+
+
+class Subscription(object):
+    """
+    Independent read cursor on an EventBus. Reading never removes an event
+    for the other subscribers.
+    """
+
+    def __init__(self, bus, cursor):
+        self._bus = bus
+        self.cursor = cursor
+        self.dropped = 0
+
+    def poll(self, max_events=None):
+        """Returns the events published since the last poll, oldest first
+
+        Arguments:
+            max_events (int): Maximum number of events to return, all if None
+        """
+        return self._bus._read(self, max_events)
+
+    def get(self):
+        """Returns the next event, or None if there is no new event"""
+        events = self._bus._read(self, 1)
+        return events[0] if events else None
+
+    def pending(self):
+        """Returns the number of events waiting for this subscriber"""
+        return self._bus.next_seq - max(self.cursor, self._bus.oldest_seq)
+
+    def close(self):
+        """Stops following the bus"""
+        self._bus.unsubscribe(self)
+
+
+class EventBus(object):
+    """
+    This class keeps the most recent anomaly events in a fixed-capacity
+    ring buffer. Any number of subscribers read it through their own cursor.
+
+    Overflow policies, when the buffer is full:
+        drop_oldest: the oldest event is overwritten, subscribers that had not
+            read it count it in their `dropped` counter
+        drop_newest: the new event is rejected and counted in `dropped`, as long
+            as a subscriber still has to read the oldest one
+    """
+
+    OVERFLOW_POLICIES = ("drop_oldest", "drop_newest")
+
+    def __init__(self, capacity=1024, overflow="drop_oldest"):
+        """
+        Arguments:
+            capacity (int): Maximal number of events kept
+            overflow (str): "drop_oldest" or "drop_newest"
+        """
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError("overflow must be one of {}".format(self.OVERFLOW_POLICIES))
+
+        self.capacity = capacity
+        self.overflow = overflow
+        self.dropped = 0
+        self._buffer = [None] * capacity
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._first_seq = 0
+        self.next_seq = 0
+
+    @property
+    def oldest_seq(self):
+        """Sequence number of the oldest event still in the buffer"""
+        return max(self.next_seq - self.capacity, self._first_seq)
+
+    def __len__(self):
+        return self.next_seq - self.oldest_seq
+
+    def publish(self, event):
+        """Adds an event to the bus. Returns False if it was dropped."""
+        with self._lock:
+            if self.next_seq - self.oldest_seq >= self.capacity and self.overflow == "drop_newest":
+                if any(sub.cursor <= self.oldest_seq for sub in self._subscribers):
+                    self.dropped += 1
+                    return False
+
+            event.seq = self.next_seq
+            self._buffer[self.next_seq % self.capacity] = event
+            self.next_seq += 1
+            return True
+
+    def subscribe(self, from_start=False):
+        """Returns a new Subscription reading the events published from now on
+
+        Arguments:
+            from_start (bool): Also read the events still in the buffer
+        """
+        with self._lock:
+            subscription = Subscription(self, self.oldest_seq if from_start else self.next_seq)
+            self._subscribers.append(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    def snapshot(self):
+        """Returns every event still in the buffer, oldest first, without consuming them"""
+        with self._lock:
+            return [self._buffer[seq % self.capacity] for seq in range(self.oldest_seq, self.next_seq)]
+
+    def clear(self):
+        """Forgets every event, the subscribers start over from the next one"""
+        with self._lock:
+            self._buffer = [None] * self.capacity
+            self._first_seq = self.next_seq
+            for subscription in self._subscribers:
+                subscription.cursor = self.next_seq
+
+    def _read(self, subscription, max_events):
+        with self._lock:
+            oldest = self.oldest_seq
+            if subscription.cursor < oldest:
+                subscription.dropped += oldest - subscription.cursor
+                subscription.cursor = oldest
+
+            end = self.next_seq
+            if max_events is not None:
+                end = min(end, subscription.cursor + max_events)
+
+            events = [self._buffer[seq % self.capacity] for seq in range(subscription.cursor, end)]
+            subscription.cursor = end
+            return events
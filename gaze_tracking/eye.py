@@ -1,6 +1,8 @@
 import math
+import threading
 import numpy as np
 import cv2
+from .instrumentation import DISABLED
 from .pupil import Pupil
 
 
@@ -13,74 +15,110 @@ class Eye(object):
     LEFT_EYE_POINTS = [36, 37, 38, 39, 40, 41]
     RIGHT_EYE_POINTS = [42, 43, 44, 45, 46, 47]
 
-    def __init__(self, original_frame, landmarks, side, calibration):
+    # Scratch mask reused by every eye isolated in the same thread
+    _scratch = threading.local()
+
+    def __init__(self, original_frame, landmarks, side, calibration, points=None, iris=None,
+                 instrumentation=None):
         self.frame = None
         self.origin = None
         self.center = None
         self.pupil = None
         self.landmark_points = None
 
-        self._analyze(original_frame, landmarks, side, calibration)
+        self._analyze(original_frame, landmarks, side, calibration, points, iris, instrumentation or DISABLED)
 
     @staticmethod
     def _middle_point(p1, p2):
         """Returns the middle point (x,y) between two points
 
         Arguments:
-            p1 (dlib.point): First point
-            p2 (dlib.point): Second point
+            p1 (numpy.ndarray): First point
+            p2 (numpy.ndarray): Second point
         """
-        x = int((p1.x + p2.x) / 2)
-        y = int((p1.y + p2.y) / 2)
+        x = int((p1[0] + p2[0]) / 2)
+        y = int((p1[1] + p2[1]) / 2)
         return (x, y)
 
+    @classmethod
+    def _mask_buffer(cls, height, width):
+        """Returns a zeroed mask of the given size taken from a reusable buffer
+
+        Arguments:
+            height (int): Height of the eye region
+            width (int): Width of the eye region
+        """
+        buffer = getattr(cls._scratch, 'mask', None)
+        if buffer is None or buffer.shape[0] < height or buffer.shape[1] < width:
+            buffer = np.empty((max(height, 64), max(width, 128)), np.uint8)
+            cls._scratch.mask = buffer
+        mask = buffer[:height, :width]
+        mask.fill(0)
+        return mask
+
     def _isolate(self, frame, landmarks, points):
         """Isolate an eye, to have a frame without other part of the face.
+        Only the bounding box of the eye is copied and masked, so the cost
+        depends on the size of the eye and not on the size of the frame.
 
         Arguments:
             frame (numpy.ndarray): Frame containing the face
-            landmarks (dlib.full_object_detection): Facial landmarks for the face region
+            landmarks (numpy.ndarray): (68, 2) array of facial landmarks for the face region
             points (list): Points of an eye (from the 68 Multi-PIE landmarks)
         """
-        region = np.array([(landmarks.part(point).x, landmarks.part(point).y) for point in points])
-        region = region.astype(np.int32)
-        self.landmark_points = region
+        # Cropping on the eye
+        min_x, min_y, max_x, max_y = self._locate(landmarks, points)
+        region = self.landmark_points
+        roi = frame[min_y:max_y, min_x:max_x]
+
+        # Applying a mask to get only the eye, everything outside of it is white
+        height, width = roi.shape[:2]
+        mask = self._mask_buffer(height, width)
+        cv2.fillPoly(mask, [region - (min_x, min_y)], 255)
+        eye = np.full((height, width), 255, np.uint8)
+        cv2.copyTo(roi, mask, eye)
+
+        self.frame = eye
+        self.center = (width / 2, height / 2)
 
-        # Applying a mask to get only the eye
-        height, width = frame.shape[:2]
-        black_frame = np.zeros((height, width), np.uint8)
-        mask = np.full((height, width), 255, np.uint8)
-        cv2.fillPoly(mask, [region], (0, 0, 0))
-        eye = cv2.bitwise_not(black_frame, frame.copy(), mask=mask)
+    def _locate(self, landmarks, points):
+        """Sets the origin and the center of the eye region, without extracting the eye frame
+
+        Arguments:
+            landmarks (numpy.ndarray): (n, 2) array of facial landmarks for the face region
+            points (list): Points of an eye
+
+        Returns:
+            (min_x, min_y, max_x, max_y) bounds of the eye region, with a margin
+        """
+        region = landmarks[points]
+        self.landmark_points = region
 
-        # Cropping on the eye
         margin = 5
         min_x = np.min(region[:, 0]) - margin
         max_x = np.max(region[:, 0]) + margin
         min_y = np.min(region[:, 1]) - margin
         max_y = np.max(region[:, 1]) + margin
 
-        self.frame = eye[min_y:max_y, min_x:max_x]
         self.origin = (min_x, min_y)
-
-        height, width = self.frame.shape[:2]
-        self.center = (width / 2, height / 2)
+        self.center = ((max_x - min_x) / 2, (max_y - min_y) / 2)
+        return min_x, min_y, max_x, max_y
 
     def _blinking_ratio(self, landmarks, points):
         """Calculates a ratio that can indicate whether an eye is closed or not.
         It's the division of the width of the eye, by its height.
 
         Arguments:
-            landmarks (dlib.full_object_detection): Facial landmarks for the face region
+            landmarks (numpy.ndarray): (68, 2) array of facial landmarks for the face region
             points (list): Points of an eye (from the 68 Multi-PIE landmarks)
 
         Returns:
             The computed ratio
         """
-        left = (landmarks.part(points[0]).x, landmarks.part(points[0]).y)
-        right = (landmarks.part(points[3]).x, landmarks.part(points[3]).y)
-        top = self._middle_point(landmarks.part(points[1]), landmarks.part(points[2]))
-        bottom = self._middle_point(landmarks.part(points[5]), landmarks.part(points[4]))
+        left = landmarks[points[0]]
+        right = landmarks[points[3]]
+        top = self._middle_point(landmarks[points[1]], landmarks[points[2]])
+        bottom = self._middle_point(landmarks[points[5]], landmarks[points[4]])
 
         eye_width = math.hypot((left[0] - right[0]), (left[1] - right[1]))
         eye_height = math.hypot((top[0] - bottom[0]), (top[1] - bottom[1]))
@@ -92,28 +130,44 @@ class Eye(object):
 
         return ratio
 
-    def _analyze(self, original_frame, landmarks, side, calibration):
+    def _analyze(self, original_frame, landmarks, side, calibration, points=None, iris=None, timer=DISABLED):
         """Detects and isolates the eye in a new frame, sends data to the calibration
         and initializes Pupil object.
 
         Arguments:
             original_frame (numpy.ndarray): Frame passed by the user
-            landmarks (dlib.full_object_detection): Facial landmarks for the face region
+            landmarks (numpy.ndarray): (n, 2) array of facial landmarks for the face region
             side: Indicates whether it's the left eye (0) or the right eye (1)
             calibration (calibration.Calibration): Manages the binarization threshold value
+            points (list): Landmarks of the eye, the 68 Multi-PIE ones of the side if None
+            iris (numpy.ndarray): Iris center given by the landmark model, the pupil
+                is then not searched by thresholding and the calibration is not used
+            timer (instrumentation.Instrumentation): Times the isolation, calibration and pupil stages
         """
-        if side == 0:
-            points = self.LEFT_EYE_POINTS
-        elif side == 1:
-            points = self.RIGHT_EYE_POINTS
-        else:
-            return
+        if points is None:
+            if side == 0:
+                points = self.LEFT_EYE_POINTS
+            elif side == 1:
+                points = self.RIGHT_EYE_POINTS
+            else:
+                return
 
         self.blinking = self._blinking_ratio(landmarks, points)
+
+        if iris is not None:
+            self._locate(landmarks, points)
+            self.pupil = Pupil.from_center(int(iris[0]) - self.origin[0], int(iris[1]) - self.origin[1])
+            return
+
+        start = timer.clock()
         self._isolate(original_frame, landmarks, points)
+        start = timer.record('eye_isolate', start)
 
         if not calibration.is_complete():
             calibration.evaluate(self.frame, side)
+        else:
+            calibration.refine(self.frame, side)
+        timer.record('calibration', start)
 
         threshold = calibration.threshold(side)
-        self.pupil = Pupil(self.frame, threshold)
+        self.pupil = Pupil(self.frame, threshold, timer)
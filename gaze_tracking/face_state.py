@@ -0,0 +1,337 @@
+from __future__ import division
+import time
+import numpy as np
+
+from .eye import Eye
+from .calibration import Calibration
+from .saccades import SaccadeDetector
+from .running_stats import RunningStatistics
+from .events import AnomalyEvent, EventCase
+from .head_pose import HeadPoseEstimator
+
+
+class FaceState(object):
+    """
+    This class holds everything GazeTracking knows about one tracked face:
+    its calibration, eyes, head pose, running averages and saccades. The
+    settings shared by every face (thresholds, event bus, timestamp of the
+    frame) are read from the GazeTracking that owns it.
+    """
+
+    # Position of the tracked metrics in the statistics vector
+    PUPIL_LEFT = slice(0, 2)
+    PUPIL_RIGHT = slice(2, 4)
+    HORIZONTAL_RATIO = 4
+    VERTICAL_RATIO = 5
+    HEAD_POSE_ANGLE = slice(6, 14)
+    NB_METRICS = 14
+
+    def __init__(self, gaze, track_id, calibration=None):
+        """
+        Arguments:
+            gaze (GazeTracking): Tracker owning this face
+            track_id (int): Id given to the face by the FaceTracker
+            calibration (calibration.Calibration): Calibration to start from, a new one if None
+        """
+        self._gaze = gaze
+        self.track_id = track_id
+        self.calibration = calibration if calibration is not None else Calibration()
+
+        self.eye_left = None
+        self.eye_right = None
+        self.rectangle_shape = None
+        self.landmarks = None
+        self.frame_shape = None  # (height, width) of the analyzed frame
+
+        # Every tracked metric lives in one vector, see the slices above
+        self.statistics = RunningStatistics(self.NB_METRICS, mode=gaze.statistics_mode)
+        self._metric_values = np.full(self.NB_METRICS, np.nan)
+        self._thresholds = np.zeros(self.NB_METRICS)
+        self._saccade_detector = SaccadeDetector(threshold=gaze.saccade_threshold)
+
+        self.start_time = time.time()
+        self.previous_time = None
+        self.num_frames = None
+        self.sampling_rate = None
+
+        self.image_points_2d = None
+        self.head_pose = HeadPoseEstimator()
+
+    def clear(self):
+        """Forgets the eyes and the pose, for a frame where the face was not found"""
+        self.eye_left = None
+        self.eye_right = None
+        self.head_pose.reset()
+
+    @property
+    def pupils_located(self):
+        """Check that the pupils have been located"""
+        try:
+            int(self.eye_left.pupil.x)
+            int(self.eye_left.pupil.y)
+            int(self.eye_right.pupil.x)
+            int(self.eye_right.pupil.y)
+            return True
+        except Exception:
+            return False
+
+    def analyze(self, frame, shape, landmarks):
+        """Initializes the Eye objects and estimates the head pose of the face
+
+        Arguments:
+            frame (numpy.ndarray): Grayscale frame
+            shape: Landmarks in the format of the backend, e.g. dlib.full_object_detection
+            landmarks (numpy.ndarray): (n, 2) array of the same landmarks
+        """
+        backend = self._gaze.backend
+        timer = self._gaze.instrumentation
+        iris = backend.IRIS_POINTS
+        try:
+            self.rectangle_shape = shape
+            self.landmarks = landmarks
+            self.frame_shape = frame.shape[:2]
+            self.eye_left = Eye(frame, landmarks, 0, self.calibration, backend.LEFT_EYE_POINTS,
+                                landmarks[iris[0]] if iris else None, timer)
+            self.eye_right = Eye(frame, landmarks, 1, self.calibration, backend.RIGHT_EYE_POINTS,
+                                 landmarks[iris[1]] if iris else None, timer)
+
+            start = timer.clock()
+            self.image_points_2d = landmarks[backend.HEAD_POSE_POINTS].astype(np.float64)
+            self.head_pose.estimate(self.image_points_2d, frame.shape)
+            start = timer.record('head_pose', start)
+
+            self._update_averages()
+            timer.record('statistics', start)
+
+        except IndexError:
+            self.eye_left = None
+            self.eye_right = None
+
+    def _update_averages(self):
+        """Update the average values of horizontal and vertical ratios, pupil coordinates, and head pose angle"""
+        if self.start_time is None:
+            self.start_time = time.time()
+
+        if self.previous_time is None:
+            self.previous_time = time.time()
+
+        if self.num_frames is None:
+            self.num_frames = 1
+        else:
+            self.num_frames += 1
+
+        elapsed_time = time.time() - self.previous_time
+
+        if elapsed_time != 0:
+            self.sampling_rate = 1 / elapsed_time
+        else:
+            self.sampling_rate = 1
+
+        self.previous_time = time.time()
+
+        values = self._metric_values
+        values.fill(np.nan)
+        if self.pupils_located:
+            values[self.PUPIL_LEFT] = self.pupil_left_coords()
+            values[self.PUPIL_RIGHT] = self.pupil_right_coords()
+            values[self.HORIZONTAL_RATIO] = self.horizontal_ratio()
+            values[self.VERTICAL_RATIO] = self.vertical_ratio()
+            self.detect_saccades()
+        values[self.HEAD_POSE_ANGLE] = self.head_pose_angle()
+
+        deviations = self.statistics.update(values)
+        exceeded = deviations > self._deviation_thresholds()
+
+        mean = self.statistics.mean
+        if exceeded[self.PUPIL_LEFT].any():
+            self._log_deviation(EventCase.PUPIL_POSITION, AnomalyEvent.PUPIL_LEFT_INFO, (
+                *mean[self.PUPIL_LEFT].tolist(), *values[self.PUPIL_LEFT].tolist(),
+                *deviations[self.PUPIL_LEFT].tolist()))
+        if exceeded[self.PUPIL_RIGHT].any():
+            self._log_deviation(EventCase.PUPIL_POSITION, AnomalyEvent.PUPIL_RIGHT_INFO, (
+                *mean[self.PUPIL_RIGHT].tolist(), *values[self.PUPIL_RIGHT].tolist(),
+                *deviations[self.PUPIL_RIGHT].tolist()))
+        if exceeded[self.HORIZONTAL_RATIO]:
+            self._log_deviation(EventCase.HORIZONTAL_RATIO, AnomalyEvent.HORIZONTAL_RATIO_INFO, (
+                float(mean[self.HORIZONTAL_RATIO]), float(values[self.HORIZONTAL_RATIO]),
+                float(deviations[self.HORIZONTAL_RATIO])))
+        if exceeded[self.VERTICAL_RATIO]:
+            self._log_deviation(EventCase.VERTICAL_RATIO, AnomalyEvent.VERTICAL_RATIO_INFO, (
+                float(mean[self.VERTICAL_RATIO]), float(values[self.VERTICAL_RATIO]),
+                float(deviations[self.VERTICAL_RATIO])))
+        if exceeded[self.HEAD_POSE_ANGLE].any():
+            self._log_deviation(EventCase.HEAD_POSE_ANGLE, AnomalyEvent.HEAD_POSE_ANGLE_INFO, (
+                *mean[self.HEAD_POSE_ANGLE].tolist(), *values[self.HEAD_POSE_ANGLE].tolist(),
+                float(deviations[self.HEAD_POSE_ANGLE].max())))
+
+    def _deviation_thresholds(self):
+        """Returns the deviation above which every metric is logged as an anomaly.
+        With deviation_sigma set, it's that many standard deviations of the metric
+        once min_samples values have been seen, otherwise the absolute thresholds.
+        """
+        thresholds = self._thresholds
+        thresholds[self.PUPIL_LEFT] = self._gaze.pupil_coords_deviation_threshold
+        thresholds[self.PUPIL_RIGHT] = self._gaze.pupil_coords_deviation_threshold
+        thresholds[self.HORIZONTAL_RATIO] = self._gaze.horizontal_ratio_deviation_threshold
+        thresholds[self.VERTICAL_RATIO] = self._gaze.vertical_ratio_deviation_threshold
+        thresholds[self.HEAD_POSE_ANGLE] = self._gaze.head_pose_angle_deviation_threshold
+
+        if self._gaze.deviation_sigma is not None:
+            ready = self.statistics.count >= self._gaze.min_samples
+            thresholds = np.where(ready, self._gaze.deviation_sigma * self.statistics.std, thresholds)
+        return thresholds
+
+    def _log_deviation(self, case, layout, values):
+        """Publishes a deviation of the given case on the event bus, see AnomalyEvent"""
+        self._gaze.events.publish(AnomalyEvent(self.num_frames, self._gaze.timestamp, case, layout, values,
+                                               self.track_id))
+
+    @property
+    def avg_pupil_left_coords(self):
+        return tuple(self.statistics.mean[self.PUPIL_LEFT].tolist())
+
+    @property
+    def avg_pupil_right_coords(self):
+        return tuple(self.statistics.mean[self.PUPIL_RIGHT].tolist())
+
+    @property
+    def avg_horizontal_ratio(self):
+        return float(self.statistics.mean[self.HORIZONTAL_RATIO])
+
+    @property
+    def avg_vertical_ratio(self):
+        return float(self.statistics.mean[self.VERTICAL_RATIO])
+
+    @property
+    def avg_head_pose_angle(self):
+        return self.statistics.mean[self.HEAD_POSE_ANGLE].tolist()
+
+    def detect_saccades(self):
+        """Feeds the middle of both pupils to the saccade detector and logs the
+        onset and the offset of every saccade once.
+
+        Returns:
+            The list of saccade events triggered by this frame
+        """
+        left = self.pupil_left_coords()
+        right = self.pupil_right_coords()
+        middle_coordinate = ((left[0] + right[0]) / 2, (left[1] + right[1]) / 2)
+
+        self._saccade_detector.threshold = self._gaze.saccade_threshold
+        event = self._saccade_detector.update(middle_coordinate, self._gaze.timestamp)
+        if event is None:
+            return []
+
+        if event['phase'] == "onset":
+            layout = AnomalyEvent.SACCADE_ONSET_INFO
+            values = (event['phase'], event['timestamp'], *event['position'], event['velocity'])
+        else:
+            layout = AnomalyEvent.SACCADE_OFFSET_INFO
+            values = (event['phase'], event['timestamp'], *event['position'], *event['onset_position'],
+                      event['duration'], event['amplitude'], event['peak_velocity'])
+        values += (*middle_coordinate, self._gaze.saccade_threshold)
+        self._gaze.events.publish(AnomalyEvent(self.num_frames, self._gaze.timestamp, EventCase.SACCADE, layout,
+                                               values, self.track_id))
+
+        return [event]
+
+    def pupil_left_coords(self):
+        """Returns the coordinates of the left pupil"""
+        if self.pupils_located:
+            x = self.eye_left.origin[0] + self.eye_left.pupil.x
+            y = self.eye_left.origin[1] + self.eye_left.pupil.y
+            return (x, y)
+
+    def pupil_right_coords(self):
+        """Returns the coordinates of the right pupil"""
+        if self.pupils_located:
+            x = self.eye_right.origin[0] + self.eye_right.pupil.x
+            y = self.eye_right.origin[1] + self.eye_right.pupil.y
+            return (x, y)
+
+    def horizontal_ratio(self):
+        """Returns a number between 0.0 and 1.0 that indicates the
+        horizontal direction of the gaze. The extreme right is 0.0,
+        the center is 0.5 and the extreme left is 1.0
+        """
+        if self.pupils_located:
+            pupil_left = self.eye_left.pupil.x / (self.eye_left.center[0] * 2 - 10)
+            pupil_right = self.eye_right.pupil.x / (self.eye_right.center[0] * 2 - 10)
+            return (pupil_left + pupil_right) / 2
+
+    def vertical_ratio(self):
+        """Returns a number between 0.0 and 1.0 that indicates the
+        vertical direction of the gaze. The extreme top is 0.0,
+        the center is 0.5 and the extreme bottom is 1.0
+        """
+        if self.pupils_located:
+            pupil_left = self.eye_left.pupil.y / (self.eye_left.center[1] * 2 - 10)
+            pupil_right = self.eye_right.pupil.y / (self.eye_right.center[1] * 2 - 10)
+            return (pupil_left + pupil_right) / 2
+
+    def head_pose_angle(self):
+        """Returns the length and the angle of the 4 edges of the head pose box
+        as an array: [length 1, angle 1, ..., length 4, angle 4].
+        None when there is no pose, e.g. once the face is lost.
+        """
+        box = self.head_pose.box()
+        if box is None:
+            return None
+        return self.head_pose.box_angles(box)
+
+    def is_right(self):
+        """Returns true if the user is looking to the right"""
+        if self.pupils_located:
+            return self.horizontal_ratio() <= 0.5
+
+    def is_left(self):
+        """Returns true if the user is looking to the left"""
+        if self.pupils_located:
+            return self.horizontal_ratio() >= 0.7
+
+    def is_center(self):
+        """Returns true if the user is looking to the center"""
+        if self.pupils_located:
+            return self.is_right() is not True and self.is_left() is not True
+
+    def is_blinking(self):
+        """Returns true if the user closes his eyes"""
+        if self.pupils_located:
+            blinking_ratio = (self.eye_left.blinking + self.eye_right.blinking) / 2
+            return blinking_ratio > 3.8
+
+    def metrics(self):
+        """Returns the measurements of the last analyzed frame as plain values"""
+        face_found = self.eye_left is not None and self.eye_right is not None
+        located = self.pupils_located
+        head_pose_angle = self.head_pose_angle() if face_found else None
+
+        def to_float(coords):
+            return None if coords is None else (float(coords[0]), float(coords[1]))
+
+        return {
+            'face_id': self.track_id,
+            'frame': self.num_frames,
+            'timestamp': self._gaze.timestamp,
+            'face': face_found,
+            'pupil_left': to_float(self.pupil_left_coords()),
+            'pupil_right': to_float(self.pupil_right_coords()),
+            'horizontal_ratio': float(self.horizontal_ratio()) if located else None,
+            'vertical_ratio': float(self.vertical_ratio()) if located else None,
+            'blinking': bool(self.is_blinking()) if located else None,
+            'head_pose_angle': head_pose_angle.tolist() if head_pose_angle is not None else None,
+        }
+
+    def overlay(self):
+        """Returns the geometry of this face drawn by GazeTracking.draw_overlay,
+        None if there is nothing to draw
+        """
+        if not self.pupils_located:
+            return None
+
+        return {
+            'shape': self.frame_shape,
+            'pupils': (self.pupil_left_coords(), self.pupil_right_coords()),
+            'landmarks': self.landmarks,
+            'box': tuple((int(x), int(y)) for x, y in self.head_pose.box()),
+        }
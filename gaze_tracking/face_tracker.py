@@ -0,0 +1,385 @@
+from __future__ import division
+import numpy as np
+import cv2
+import dlib
+
+
+class Track(object):
+    """A face followed by FaceTracker across frames"""
+
+    __slots__ = ('track_id', 'rectangle', 'landmark_box', 'layout', 'unverified', 'lost', 'missed')
+
+    def __init__(self, track_id, rectangle):
+        self.track_id = track_id
+        self.rectangle = rectangle
+        self.landmark_box = None
+        self.layout = None  # (inter-ocular distance, face layout) of the last landmarks
+        self.unverified = 0  # frames tracked since the detector last confirmed the face
+        self.lost = False
+        self.missed = 0
+
+    def __repr__(self):
+        return "Track(id={}, rectangle={}, lost={})".format(self.track_id, self.rectangle, self.lost)
+
+
+class FaceTracker(object):
+    """
+    This class keeps track of the face rectangles between frames so that
+    the HOG face detector doesn't have to scan the whole frame every time.
+    The landmarks found in a frame are used to move each rectangle for the
+    next one, and a full detection only runs every `redetect_interval`
+    frames or when a tracked box stops being trustworthy.
+
+    The shape predictor always places its landmarks in the rectangle it is
+    given, face or not, so a track is only trusted while its landmarks keep
+    the layout of the previous frame (inter-ocular distance, nose, mouth and
+    chin relative to the eyes) and the detector, run with its score on the
+    padded box every `verify_interval` frames, still finds a face there.
+
+    Every face gets a track id that stays the same as long as its box
+    overlaps the one of the previous frame. At most `max_faces` faces are
+    tracked, the largest ones are preferred when new faces appear.
+    """
+
+    FALLBACK_POLICIES = ("roi", "full")
+
+    def __init__(self, detector, redetect_interval=10, padding=0.25, min_iou=0.6,
+                 max_shape_change=0.25, verify_interval=1, min_detection_score=-0.5,
+                 fallback="roi", detection_scale=1.0, max_faces=1, max_lost_frames=5):
+        """
+        Arguments:
+            detector: dlib frontal face detector (or any callable with the same signature)
+            redetect_interval (int): Number of frames after which a full detection is forced,
+                0 disables tracking and runs a detection on every frame
+            padding (float): Fraction of the face size added on each side of the
+                last rectangle to build the search region
+            min_iou (float): Below this overlap between two consecutive boxes the
+                track is considered unstable
+            max_shape_change (float): Largest change of the face layout between two frames,
+                relative to the inter-ocular distance, and of that distance, for the track to be kept
+            verify_interval (int): Every verify_interval tracked frames, the detector runs on
+                the padded box of the track and the track is lost if it finds no face there
+                (0 only checks the layout). Each check costs a detection on the box only.
+            min_detection_score (float): Score above which the detector confirms a face, given
+                to detector.run as adjust_threshold: below 0 accepts less frontal faces than
+                a detection
+            fallback (str): What to do when a track is lost: "roi" looks in the padded
+                region first and then in the whole frame, "full" goes to the whole frame
+            detection_scale (float): The detector runs on a copy of the frame resized by this
+                factor (e.g. 0.25), its cost falls with the square of the factor. The HOG
+                detector misses faces smaller than about 80px in the resized image.
+            max_faces (int): Maximal number of faces tracked at once. With a single face,
+                the track id is always 0.
+            max_lost_frames (int): Number of full detections a face can be missing from
+                before its track id is forgotten
+        """
+        if fallback not in self.FALLBACK_POLICIES:
+            raise ValueError("fallback must be one of {}".format(self.FALLBACK_POLICIES))
+        if not 0 < detection_scale <= 1:
+            raise ValueError("detection_scale must be in ]0, 1]")
+        if max_faces < 1:
+            raise ValueError("max_faces must be at least 1")
+
+        self._detector = detector
+        self.redetect_interval = redetect_interval
+        self.padding = padding
+        self.min_iou = min_iou
+        self.max_shape_change = max_shape_change
+        self.verify_interval = verify_interval
+        self.min_detection_score = min_detection_score
+        self.fallback = fallback
+        self.detection_scale = detection_scale
+        self.max_faces = max_faces
+        self.max_lost_frames = max_lost_frames
+
+        self.tracks = {}
+        self._next_id = 0
+        self._frames_since_detection = 0
+
+        self.nb_frames = 0
+        self.nb_full_detections = 0
+        self.nb_roi_detections = 0
+        self.nb_tracked = 0
+        self.nb_lost = 0
+        self.nb_verifications = 0
+
+    @staticmethod
+    def _to_box(rect):
+        """Converts a dlib.rectangle to a (left, top, right, bottom) float array"""
+        return np.array([rect.left(), rect.top(), rect.right(), rect.bottom()], dtype=np.float64)
+
+    @staticmethod
+    def _to_rectangle(box):
+        """Converts a (left, top, right, bottom) array to a dlib.rectangle"""
+        return dlib.rectangle(int(round(box[0])), int(round(box[1])), int(round(box[2])), int(round(box[3])))
+
+    @staticmethod
+    def iou(box_a, box_b):
+        """Returns the intersection over union of two (left, top, right, bottom) boxes"""
+        width = min(box_a[2], box_b[2]) - max(box_a[0], box_b[0])
+        height = min(box_a[3], box_b[3]) - max(box_a[1], box_b[1])
+        if width <= 0 or height <= 0:
+            return 0.0
+        inter = width * height
+        area_a = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1])
+        area_b = (box_b[2] - box_b[0]) * (box_b[3] - box_b[1])
+        return inter / (area_a + area_b - inter)
+
+    def _search_region(self, rectangle, shape):
+        """Returns the padded region around a rectangle, clipped to the frame"""
+        height, width = shape[:2]
+        left, top, right, bottom = self._to_box(rectangle)
+        pad_x = (right - left) * self.padding
+        pad_y = (bottom - top) * self.padding
+        return (max(int(left - pad_x), 0), max(int(top - pad_y), 0),
+                min(int(right + pad_x), width), min(int(bottom + pad_y), height))
+
+    def _detect(self, frame, region=None, adjust_threshold=None):
+        """Runs the face detector on the frame, or only inside the given region.
+        The image is downscaled by detection_scale first and the rectangles are
+        mapped back to full resolution coordinates.
+
+        Arguments:
+            adjust_threshold (float): Score threshold given to detector.run, the
+                default one of the detector if None or if it has no run method
+        """
+        left, top = 0, 0
+        if region is not None:
+            left, top, right, bottom = region
+            if right - left <= 0 or bottom - top <= 0:
+                return []
+            frame = frame[top:bottom, left:right]
+
+        scale = self.detection_scale
+        if scale != 1:
+            frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        elif region is not None:
+            frame = np.ascontiguousarray(frame)
+
+        if adjust_threshold is not None and hasattr(self._detector, 'run'):
+            rectangles = self._detector.run(frame, 0, adjust_threshold)[0]
+        else:
+            rectangles = self._detector(frame, 0)
+        return [dlib.rectangle(int(r.left() / scale) + left, int(r.top() / scale) + top,
+                               int(r.right() / scale) + left, int(r.bottom() / scale) + top)
+                for r in rectangles]
+
+    def _closest(self, track, faces):
+        """Returns the detected face that overlaps the most with the rectangle of the track"""
+        if len(faces) == 1:
+            return faces[0]
+        box = self._to_box(track.rectangle)
+        return max(faces, key=lambda face: self.iou(box, self._to_box(face)))
+
+    def _match(self, faces):
+        """Pairs the tracks and the detected faces by decreasing overlap
+
+        Returns:
+            (list of (track, face) pairs, tracks without a face, faces without a track)
+        """
+        boxes = [self._to_box(face) for face in faces]
+        candidates = []
+        for track in self.tracks.values():
+            track_box = self._to_box(track.rectangle)
+            for index, box in enumerate(boxes):
+                overlap = self.iou(track_box, box)
+                if overlap > 0:
+                    candidates.append((overlap, track, index))
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+        pairs, matched_faces = [], set()
+        for _, track, index in candidates:
+            if any(track is paired for paired, _ in pairs) or index in matched_faces:
+                continue
+            pairs.append((track, faces[index]))
+            matched_faces.add(index)
+
+        paired_tracks = [paired for paired, _ in pairs]
+        unmatched_tracks = [track for track in self.tracks.values() if track not in paired_tracks]
+        unmatched_faces = [face for index, face in enumerate(faces) if index not in matched_faces]
+        return pairs, unmatched_tracks, unmatched_faces
+
+    def _new_id(self):
+        if self.max_faces == 1:
+            # A single subject keeps the same id, and so its calibration, across losses
+            return 0
+        track_id = self._next_id
+        self._next_id += 1
+        return track_id
+
+    @staticmethod
+    def _assign(track, face):
+        track.rectangle = face
+        track.landmark_box = None
+        track.layout = None
+        track.unverified = 0
+        track.lost = False
+        track.missed = 0
+
+    def _update_tracks(self, faces):
+        """Updates the tracks with the faces of a full detection"""
+        pairs, unmatched_tracks, new_faces = self._match(faces)
+        for track, face in pairs:
+            self._assign(track, face)
+        for track in unmatched_tracks:
+            track.lost = True
+            track.missed += 1
+
+        # New faces take the free places first, then the ones of the tracks missing the longest
+        new_faces.sort(key=lambda face: face.width() * face.height(), reverse=True)
+        unmatched_tracks.sort(key=lambda track: track.missed, reverse=True)
+        for face in new_faces:
+            if len(self.tracks) >= self.max_faces:
+                if not unmatched_tracks:
+                    break
+                del self.tracks[unmatched_tracks.pop(0).track_id]
+            track = Track(self._new_id(), face)
+            self.tracks[track.track_id] = track
+
+        for track in unmatched_tracks:
+            if track.missed > self.max_lost_frames:
+                del self.tracks[track.track_id]
+
+    def _located(self):
+        return [(track_id, self.tracks[track_id].rectangle)
+                for track_id in sorted(self.tracks) if not self.tracks[track_id].lost]
+
+    def locate(self, frame):
+        """Returns the faces to analyze in this frame as a list of
+        (track id, rectangle) pairs sorted by track id, empty if there is no face.
+
+        Arguments:
+            frame (numpy.ndarray): Grayscale frame
+        """
+        self.nb_frames += 1
+        tracking = self.redetect_interval > 0 and bool(self.tracks)
+        lost = [track for track in self.tracks.values() if track.lost]
+
+        if tracking and not lost and self._frames_since_detection < self.redetect_interval:
+            self._frames_since_detection += 1
+            self.nb_tracked += 1
+            return self._located()
+
+        if tracking and lost and self.fallback == "roi":
+            recovered = 0
+            for track in lost:
+                faces = self._detect(frame, self._search_region(track.rectangle, frame.shape))
+                if faces:
+                    self._assign(track, self._closest(track, faces))
+                    recovered += 1
+            if recovered == len(lost):
+                self.nb_roi_detections += 1
+                self._frames_since_detection = 0
+                return self._located()
+
+        # One detection over the whole frame finds every face at once
+        self._update_tracks(self._detect(frame))
+        self.nb_full_detections += 1
+        self._frames_since_detection = 0
+        return self._located()
+
+    @staticmethod
+    def layout(landmarks):
+        """Returns the inter-ocular distance of 68 landmarks, and the position of the nose
+        tip, mouth corners and chin in the frame of the eyes, in inter-ocular distances:
+        x along the eye line, y below it. None if the eyes are on top of each other.
+        """
+        left_eye = landmarks[36:42].mean(axis=0)
+        right_eye = landmarks[42:48].mean(axis=0)
+        axis = right_eye - left_eye
+        distance = np.hypot(axis[0], axis[1])
+        if distance < 1:
+            return None
+        x_axis = axis / distance
+        y_axis = np.array([-x_axis[1], x_axis[0]])
+        points = landmarks[[30, 48, 54, 8]] - (left_eye + right_eye) / 2
+        return distance, np.stack((points.dot(x_axis), points.dot(y_axis)), axis=1) / distance
+
+    def _plausible(self, track, layout):
+        """Checks that the landmarks have the layout of a face, close to the one of the previous frame"""
+        if layout is None:
+            return False
+        distance, points = layout
+        # Nose, mouth and chin below the eyes, the chin below the nose
+        if (points[:, 1] <= 0).any() or points[3, 1] <= points[0, 1]:
+            return False
+        if track.layout is None:
+            return True
+        previous_distance, previous_points = track.layout
+        return (abs(np.log(distance / previous_distance)) <= np.log1p(self.max_shape_change)
+                and np.abs(points - previous_points).max() <= self.max_shape_change)
+
+    def refine(self, track_id, landmarks, frame):
+        """Moves the rectangle of a track with the landmarks found inside it, and
+        decides whether the track can be used for the next frame. A lost track
+        is searched again by the next locate().
+
+        Arguments:
+            track_id (int): Track the landmarks belong to
+            landmarks (numpy.ndarray): (68, 2) array of landmark coordinates
+            frame (numpy.ndarray): Grayscale frame the landmarks were found in
+
+        Returns:
+            False if the landmarks are not the ones of a face and must not be used
+        """
+        track = self.tracks.get(track_id)
+        if track is None or self.redetect_interval <= 0:
+            return True
+
+        layout = self.layout(landmarks)
+        landmark_box = np.array([landmarks[:, 0].min(), landmarks[:, 1].min(),
+                                 landmarks[:, 0].max(), landmarks[:, 1].max()], dtype=np.float64)
+        old_box = self._to_box(track.rectangle)
+
+        if track.landmark_box is None:
+            new_box = old_box
+        else:
+            # Same translation and scale as the landmarks between the two frames
+            scale = (landmark_box[2] - landmark_box[0]) / max(track.landmark_box[2] - track.landmark_box[0], 1)
+            old_center = (track.landmark_box[:2] + track.landmark_box[2:]) / 2
+            new_center = (landmark_box[:2] + landmark_box[2:]) / 2
+            box_center = (old_box[:2] + old_box[2:]) / 2 + (new_center - old_center)
+            half_size = (old_box[2:] - old_box[:2]) * scale / 2
+            new_box = np.concatenate((box_center - half_size, box_center + half_size))
+
+        height, width = frame.shape[:2]
+        in_frame = new_box[0] >= 0 and new_box[1] >= 0 and new_box[2] <= width and new_box[3] <= height
+
+        plausible = self._plausible(track, layout)
+        if plausible and track.landmark_box is not None and self.verify_interval > 0:
+            # The box of a fresh detection needs no confirmation
+            track.unverified += 1
+            if track.unverified >= self.verify_interval:
+                track.unverified = 0
+                self.nb_verifications += 1
+                region = self._search_region(track.rectangle, frame.shape)
+                plausible = bool(self._detect(frame, region, self.min_detection_score))
+
+        if not plausible or not in_frame or self.iou(old_box, new_box) < self.min_iou:
+            track.lost = True
+            self.nb_lost += 1
+            return plausible
+
+        track.rectangle = self._to_rectangle(new_box)
+        track.landmark_box = landmark_box
+        track.layout = layout
+        return True
+
+    def reset(self):
+        """Forgets every tracked face, the next frame will run a full detection"""
+        self.tracks = {}
+        self._frames_since_detection = 0
+
+    def stats(self):
+        """Returns counters about how often the detector had to run"""
+        nb_frames = max(self.nb_frames, 1)
+        return {
+            'frames': self.nb_frames,
+            'faces': len(self.tracks),
+            'full_detections': self.nb_full_detections,
+            'roi_detections': self.nb_roi_detections,
+            'tracked': self.nb_tracked,
+            'lost': self.nb_lost,
+            'verifications': self.nb_verifications,
+            'full_detection_rate': self.nb_full_detections / nb_frames,
+        }
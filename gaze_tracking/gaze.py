@@ -1,120 +1,172 @@
+from __future__ import division
 import cv2
 import numpy as np
 
-relative = lambda landmark, shape: (int(landmark.x * shape[1]), int(landmark.y * shape[0]))
-relativeT = lambda landmark, shape: (int(landmark.x * shape[1]), int(landmark.y * shape[0]), 0)
+from .head_pose import HeadPoseEstimator
 
-def gaze(frame, points):
+
+class GazeEstimator(object):
     """
-    The gaze function gets an image and face landmarks from mediapipe framework.
-    The function draws the gaze direction into the frame.
+    This class estimates the gaze direction of both eyes from the landmarks
+    of mediapipe FaceMesh (with refined iris landmarks).
+
+    The pupils are mapped from the image to the head model with an affine
+    transform, pushed away from the eyeball centers and projected back on
+    the image. The transform is only fitted again when the head moved in
+    the image. One estimator must be used per face.
     """
 
-    '''
-    2D image points.
-    relative takes mediapipe points that is normalized to [-1, 1] and returns image points
-    at (x,y) format
-    '''
-    image_points = np.array([
-        relative(points.landmark[4], frame.shape),  # Nose tip
-        relative(points.landmark[152], frame.shape),  # Chin
-        relative(points.landmark[263], frame.shape),  # Left eye left corner
-        relative(points.landmark[33], frame.shape),  # Right eye right corner
-        relative(points.landmark[287], frame.shape),  # Left Mouth corner
-        relative(points.landmark[57], frame.shape)  # Right mouth corner
-    ], dtype="double")
-
-    '''
-    2D image points.
-    relativeT takes mediapipe points that is normalized to [-1, 1] and returns image points
-    at (x,y,0) format
-    '''
-    image_points1 = np.array([
-        relativeT(points.landmark[4], frame.shape),  # Nose tip
-        relativeT(points.landmark[152], frame.shape),  # Chin
-        relativeT(points.landmark[263], frame.shape),  # Left eye, left corner
-        relativeT(points.landmark[33], frame.shape),  # Right eye, right corner
-        relativeT(points.landmark[287], frame.shape),  # Left Mouth corner
-        relativeT(points.landmark[57], frame.shape)  # Right mouth corner
-    ], dtype="double")
-
-    # 3D model points.
-    model_points = np.array([
-        (0.0, 0.0, 0.0),  # Nose tip
-        (0, -63.6, -12.5),  # Chin
-        (-43.3, 32.7, -26),  # Left eye, left corner
-        (43.3, 32.7, -26),  # Right eye, right corner
-        (-28.9, -28.9, -24.1),  # Left Mouth corner
-        (28.9, -28.9, -24.1)  # Right mouth corner
+    # Nose tip, chin, left eye left corner, right eye right corner, left mouth corner,
+    # right mouth corner, then the left and right iris centers
+    LANDMARKS = [4, 152, 263, 33, 287, 57, 468, 473]
+    HEAD = slice(0, 6)
+    PUPILS = slice(6, 8)
+
+    # 3D model points, in the order of LANDMARKS[HEAD]
+    MODEL_POINTS = np.array([
+        (0.0, 0.0, 0.0),
+        (0.0, -63.6, -12.5),
+        (-43.3, 32.7, -26.0),
+        (43.3, 32.7, -26.0),
+        (-28.9, -28.9, -24.1),
+        (28.9, -28.9, -24.1)
+    ])
+
+    # Centers of the left and right eyeballs in the head model
+    EYE_BALL_CENTERS = np.array([
+        (29.05, 32.7, -39.5),
+        (-29.05, 32.7, -39.5)
     ])
 
-    '''
-    3D model eye points
-    The center of the eye ball
-    '''
-    Eye_ball_center_right = np.array([[-29.05], [32.7], [-39.5]])
-    Eye_ball_center_left = np.array([[29.05], [32.7], [-39.5]])  # the center of the left eyeball as a vector.
-
-    '''
-    camera matrix estimation
-    '''
-    focal_length = frame.shape[1]
-    center = (frame.shape[1] / 2, frame.shape[0] / 2)
-    camera_matrix = np.array(
-        [[focal_length, 0, center[0]],
-         [0, focal_length, center[1]],
-         [0, 0, 1]], dtype="double"
-    )
-
-    dist_coeffs = np.zeros((4, 1))  # Assuming no lens distortion
-    (success, rotation_vector, translation_vector) = cv2.solvePnP(
-        model_points,
-        image_points,
-        camera_matrix,
-        dist_coeffs,
-        flags=cv2.SOLVEPNP_ITERATIVE
-    )
-
-    # 2d pupil location
-    left_pupil = relative(points.landmark[468], frame.shape)
-    right_pupil = relative(points.landmark[473], frame.shape)
-
-    # Transformation between image point to world point
-    _, transformation, _ = cv2.estimateAffine3D(image_points1, model_points)  # image to world transformation
-
-    if transformation is not None:  # if estimateAffine3D succeeded
-        # project left pupil image point into 3D world point
-        left_pupil_world_cord = transformation @ np.array([[left_pupil[0], left_pupil[1], 0, 1]]).T
-
-        # project right pupil image point into 3D world point
-        right_pupil_world_cord = transformation @ np.array([[right_pupil[0], right_pupil[1], 0, 1]]).T
-
-        # 3D gaze points (10 is arbitrary value denoting gaze distance)
-        left_gaze = Eye_ball_center_left + (left_pupil_world_cord - Eye_ball_center_left) * 10
-        right_gaze = Eye_ball_center_right + (right_pupil_world_cord - Eye_ball_center_right) * 10
-
-        # Project the 3D gaze directions onto the image plane.
-        (left_gaze_2d, _) = cv2.projectPoints((int(left_gaze[0]), int(left_gaze[1]), int(left_gaze[2])),
-                                              rotation_vector, translation_vector, camera_matrix, dist_coeffs)
-        (right_gaze_2d, _) = cv2.projectPoints((int(right_gaze[0]), int(right_gaze[1]), int(right_gaze[2])),
-                                               rotation_vector, translation_vector, camera_matrix, dist_coeffs)
-
-        # project 3D head pose into the image plane
-        (left_head_pose, _) = cv2.projectPoints((int(left_pupil_world_cord[0]), int(left_pupil_world_cord[1]), int(40)),
-                                                rotation_vector, translation_vector, camera_matrix, dist_coeffs)
-        (right_head_pose, _) = cv2.projectPoints(
-            (int(right_pupil_world_cord[0]), int(right_pupil_world_cord[1]), int(40)),
-            rotation_vector, translation_vector, camera_matrix, dist_coeffs)
-
-        # correct gaze for head rotation
-        left_gaze_direction = left_pupil + (left_gaze_2d[0][0] - left_pupil) - (left_head_pose[0][0] - left_pupil)
-        right_gaze_direction = right_pupil + (right_gaze_2d[0][0] - right_pupil) - (right_head_pose[0][0] - right_pupil)
-
-        # Draw gaze lines on the frame
-        left_pupil_pt = (int(left_pupil[0]), int(left_pupil[1]))
-        left_gaze_pt = (int(left_gaze_direction[0]), int(left_gaze_direction[1]))
-        cv2.line(frame, left_pupil_pt, left_gaze_pt, (0, 0, 255), 2)
-
-        right_pupil_pt = (int(right_pupil[0]), int(right_pupil[1]))
-        right_gaze_pt = (int(right_gaze_direction[0]), int(right_gaze_direction[1]))
-        cv2.line(frame, right_pupil_pt, right_gaze_pt, (0, 0, 255), 2)
+    # Depth of the pupils in the head model, used to remove the head rotation from the gaze
+    HEAD_DEPTH = 40.0
+
+    def __init__(self, distance=10, tolerance=2.0):
+        """
+        Arguments:
+            distance (float): Length of the gaze, as a multiple of the eyeball center to pupil distance
+            tolerance (float): Largest displacement in pixels of the head landmarks before the
+                image to model transform is fitted again (0 fits it on every frame)
+        """
+        self.distance = distance
+        self.tolerance = tolerance
+        self.head_pose = HeadPoseEstimator(model_points=self.MODEL_POINTS)
+
+        # Buffers reused from frame to frame
+        self._points = np.zeros((len(self.LANDMARKS), 2))
+        self._image_points = np.ones((6, 3))  # homogeneous head landmarks
+        self._pupils = np.ones((2, 3))  # homogeneous pupils
+        self._model = np.zeros((4, 3))  # gaze points then head points, in the head model
+
+        self.transformation = None
+        self._fitted_points = None
+        self.nb_fits = 0
+
+        self.pupils = None
+        self.points = None
+        self.directions = None
+
+    def _gather(self, landmarks, shape):
+        """Fills _points with the image coordinates of LANDMARKS
+
+        Arguments:
+            landmarks: mediapipe NormalizedLandmarkList, or (n, 2) array of image coordinates
+            shape (tuple): Shape of the frame
+        """
+        if isinstance(landmarks, np.ndarray):
+            self._points[:] = landmarks[self.LANDMARKS]
+            return self._points
+
+        landmark = landmarks.landmark
+        for row, index in enumerate(self.LANDMARKS):
+            self._points[row, 0] = landmark[index].x
+            self._points[row, 1] = landmark[index].y
+        self._points *= (shape[1], shape[0])
+        return np.trunc(self._points, out=self._points)
+
+    def _fit(self, head_points):
+        """Returns the (3, 3) image to model transform, fitted again only if the head moved.
+
+        The image points all lie on z = 0, so estimateAffine3D only gets degenerate
+        samples and fails. The plane of the image is mapped by least squares instead.
+        """
+        if (self.transformation is None or self.tolerance <= 0
+                or np.abs(head_points - self._fitted_points).max() > self.tolerance):
+            self._image_points[:, :2] = head_points
+            solution, _, rank, _ = np.linalg.lstsq(self._image_points, self.MODEL_POINTS, rcond=None)
+            self.nb_fits += 1
+            if rank < 3:  # landmarks on a line
+                return None
+            self.transformation = solution.T
+            self._fitted_points = head_points.copy()
+        return self.transformation
+
+    def estimate(self, landmarks, shape):
+        """Estimates the gaze of both eyes. Returns the (2, 2) image vectors going from
+        the left and right pupils to where they look, None if it failed.
+
+        Arguments:
+            landmarks: mediapipe NormalizedLandmarkList, or (n, 2) array of image coordinates
+            shape (tuple): Shape of the frame
+        """
+        points = self._gather(landmarks, shape)
+        head_points = points[self.HEAD]
+        self.head_pose.estimate(head_points, shape)
+
+        transformation = self._fit(head_points)
+        if transformation is None:
+            self.pupils = self.points = self.directions = None
+            return None
+
+        # Pupils in the head model
+        self._pupils[:, :2] = points[self.PUPILS]
+        world = self._pupils @ transformation.T
+
+        # Gaze points, and the pupils moved to the depth of the head to correct its rotation
+        self.directions = world - self.EYE_BALL_CENTERS
+        np.multiply(self.directions, self.distance, out=self._model[:2])
+        self._model[:2] += self.EYE_BALL_CENTERS
+        self._model[2:, :2] = world[:, :2]
+        self._model[2:, 2] = self.HEAD_DEPTH
+        projected = self.head_pose.project(self._model)
+
+        self.pupils = points[self.PUPILS].copy()
+        self.points = self.pupils + projected[:2] - projected[2:]
+        return self.points - self.pupils
+
+    def draw(self, frame, color=(0, 0, 255), scale=1.0):
+        """Draws the last gaze lines on the frame
+
+        Arguments:
+            frame (numpy.ndarray): Frame drawn on
+            color (tuple): BGR color of the lines
+            scale (float): Size of the frame relative to the one the landmarks come from
+        """
+        if self.points is None:
+            return
+        for pupil, point in zip((self.pupils * scale).astype(int), (self.points * scale).astype(int)):
+            cv2.line(frame, tuple(pupil), tuple(point), color, 2)
+
+    def reset(self):
+        """Forgets the head pose and the fitted transform"""
+        self.head_pose.reset()
+        self.transformation = None
+        self._fitted_points = None
+        self.pupils = self.points = self.directions = None
+
+
+def gaze(frame, points, estimator=None):
+    """
+    Estimates the gaze of a face from its mediapipe landmarks and draws it
+    into the frame. Returns the gaze vectors, see GazeEstimator.estimate.
+
+    Arguments:
+        frame (numpy.ndarray): BGR frame, drawn on
+        points: mediapipe NormalizedLandmarkList, or (n, 2) array of image coordinates
+        estimator (GazeEstimator): Estimator of this face, kept between frames
+    """
+    if estimator is None:
+        estimator = GazeEstimator(tolerance=0)
+    vectors = estimator.estimate(points, frame.shape)
+    estimator.draw(frame)
+    return vectors
@@ -0,0 +1,134 @@
+from __future__ import division
+import cv2
+import numpy as np
+
+
+class HeadPoseEstimator(object):
+    """
+    This class estimates the pose of a head from 6 facial landmarks with
+    solvePnP, and projects a 3D box attached to the head for the head pose
+    angle metric and the overlay.
+
+    The camera model is only built when the resolution changes. Each solve
+    starts from the pose of the previous frame (useExtrinsicGuess), which
+    needs fewer iterations and keeps the pose from jumping between frames.
+    One estimator must be used per face.
+    """
+
+    # 3D model points: nose tip, chin, left eye left corner, right eye right corner,
+    # left mouth corner and right mouth corner
+    MODEL_POINTS = np.array([
+        (0.0, 0.0, 0.0),
+        (0.0, -330.0, -65.0),
+        (-225.0, 170.0, -135.0),
+        (225.0, 170.0, -135.0),
+        (-150.0, -150.0, -125.0),
+        (150.0, -150.0, -125.0)
+    ])
+
+    # Corners of the box: the inner face (b1, b2, b3, b4) lies on the face plane,
+    # the outer face (b11, b12, b13, b14) is 400 units in front of it
+    BOX_POINTS = np.array([
+        (350.0, 270.0, 0.0),
+        (-350.0, -270.0, 0.0),
+        (-350.0, 270.0, 0.0),
+        (350.0, -270.0, 0.0),
+        (450.0, 350.0, 400.0),
+        (-450.0, -350.0, 400.0),
+        (-450.0, 350.0, 400.0),
+        (450.0, -350.0, 400.0)
+    ])
+
+    def __init__(self, warm_start=True, model_points=None):
+        """
+        Arguments:
+            warm_start (bool): Start each solve from the pose of the previous frame
+            model_points (numpy.ndarray): (n, 3) head model matching the image points, MODEL_POINTS if None
+        """
+        self.warm_start = warm_start
+        self.model_points = self.MODEL_POINTS if model_points is None else model_points
+        self.dist_coeffs = np.zeros((4, 1))  # Assuming no lens distortion
+        self.camera_matrix = None
+        self._camera_size = None
+
+        self.rotation_vector = None
+        self.translation_vector = None
+        self._box = None
+
+    def _camera(self, shape):
+        """Returns the camera matrix for frames of the given shape"""
+        if self._camera_size != shape[:2]:
+            focal_length = shape[1]
+            center = (shape[1] / 2, shape[0] / 2)
+            self.camera_matrix = np.array(
+                [[focal_length, 0, center[0]],
+                 [0, focal_length, center[1]],
+                 [0, 0, 1]], dtype="double"
+            )
+            self._camera_size = shape[:2]
+            # The previous pose was expressed with another camera
+            self.reset()
+        return self.camera_matrix
+
+    def estimate(self, image_points, shape):
+        """Estimates the head pose. Returns (rotation vector, translation vector).
+
+        Arguments:
+            image_points (numpy.ndarray): (n, 2) float64 image coordinates of the model points
+            shape (tuple): Shape of the frame
+        """
+        camera_matrix = self._camera(shape)
+        self._box = None
+
+        if self.warm_start and self.rotation_vector is not None:
+            success, rotation_vector, translation_vector = cv2.solvePnP(
+                self.model_points, image_points, camera_matrix, self.dist_coeffs,
+                self.rotation_vector.copy(), self.translation_vector.copy(),
+                useExtrinsicGuess=True, flags=cv2.SOLVEPNP_ITERATIVE)
+            # A head behind the camera means the guess led the solver astray
+            if success and translation_vector[2, 0] > 0:
+                self.rotation_vector, self.translation_vector = rotation_vector, translation_vector
+                return rotation_vector, translation_vector
+
+        _, self.rotation_vector, self.translation_vector = cv2.solvePnP(
+            self.model_points, image_points, camera_matrix, self.dist_coeffs, flags=cv2.SOLVEPNP_ITERATIVE)
+        return self.rotation_vector, self.translation_vector
+
+    def project(self, points):
+        """Projects (n, 3) model space points on the image with the current pose.
+        Returns an (n, 2) array.
+        """
+        projected, _ = cv2.projectPoints(points, self.rotation_vector, self.translation_vector,
+                                         self.camera_matrix, self.dist_coeffs)
+        return projected.reshape(-1, 2)
+
+    def box(self):
+        """Returns the (8, 2) image coordinates of the box corners, in the order
+        b1, b2, b3, b4, b11, b12, b13, b14. Projected once per pose.
+        """
+        if self._box is None and self.rotation_vector is not None:
+            self._box = self.project(self.BOX_POINTS)
+        return self._box
+
+    @staticmethod
+    def box_angles(box):
+        """Returns the length and the angle in degrees of the 4 edges going from the
+        outer face of the box to the inner one, as [length 1, angle 1, ..., angle 4]
+        """
+        delta = box[:4] - box[4:]
+        angles = np.empty(8)
+        angles[0::2] = np.hypot(delta[:, 0], delta[:, 1])
+        angles[1::2] = np.degrees(np.arctan2(delta[:, 1], delta[:, 0]))
+        return angles
+
+    def euler_angles(self):
+        """Returns the (pitch, yaw, roll) of the head in degrees"""
+        rotation, _ = cv2.Rodrigues(self.rotation_vector)
+        angles = cv2.RQDecomp3x3(rotation)[0]
+        return np.array(angles)
+
+    def reset(self):
+        """Forgets the previous pose, the next solve starts from scratch"""
+        self.rotation_vector = None
+        self.translation_vector = None
+        self._box = None
@@ -0,0 +1,153 @@
+from __future__ import division
+import math
+import time
+from bisect import bisect_right
+
+
+class Histogram(object):
+    """
+    Durations counted in fixed buckets: 4 per octave from 10 us to 10 s.
+    Adding a duration costs a bisection and an increment, whatever the
+    number of durations, and the percentiles are read from the counts.
+    """
+
+    EDGES = tuple(1e-5 * 2 ** (k / 4) for k in range(81))
+
+    __slots__ = ('counts', 'count', 'total', 'maximum', 'last')
+
+    def __init__(self):
+        self.counts = [0] * (len(self.EDGES) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.last = None
+
+    def add(self, seconds):
+        self.counts[bisect_right(self.EDGES, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    def percentile(self, q):
+        """Returns the q-th percentile in seconds, the middle of its bucket"""
+        if not self.count:
+            return None
+        target = q / 100 * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if count and cumulative >= target:
+                break
+        if index == 0:
+            return min(self.EDGES[0], self.maximum)
+        if index == len(self.EDGES):
+            return self.maximum
+        return min(math.sqrt(self.EDGES[index - 1] * self.EDGES[index]), self.maximum)
+
+    def to_dict(self):
+        """Returns the statistics in milliseconds"""
+        def ms(seconds):
+            return None if seconds is None else seconds * 1000
+
+        return {
+            'count': self.count,
+            'mean_ms': ms(self.total / self.count) if self.count else None,
+            'p50_ms': ms(self.percentile(50)),
+            'p95_ms': ms(self.percentile(95)),
+            'p99_ms': ms(self.percentile(99)),
+            'max_ms': ms(self.maximum) if self.count else None,
+            'last_ms': ms(self.last),
+        }
+
+
+class Instrumentation(object):
+    """
+    Timers around the stages of the analysis, switched on and off at runtime.
+    A stage is timed between clock() and record(), both return at once when
+    instrumentation is disabled:
+
+        start = timer.clock()
+        ...
+        start = timer.record("stage", start)  # also starts the next stage
+
+    Each stage gets its own Histogram, a stage run several times per frame
+    (once per eye...) counts every run. A timed stage must only be run by
+    one thread at a time.
+    """
+
+    def __init__(self, enabled=False, fps_window=30):
+        """
+        Arguments:
+            enabled (bool): Time the stages
+            fps_window (int): Number of frames the frame rate is computed on
+        """
+        self.enabled = enabled
+        self.histograms = {}
+        self.frames = 0
+        self._frame_times = [None] * fps_window
+        self._clock = time.perf_counter
+
+    def clock(self):
+        """Returns the start time of a stage, None when disabled"""
+        return self._clock() if self.enabled else None
+
+    def record(self, stage, start):
+        """Adds the time elapsed since start to the stage. Returns the current time,
+        the start of the next stage, or None when disabled.
+
+        Arguments:
+            stage (str): Name of the stage
+            start (float): Result of clock() at the start of the stage
+        """
+        if start is None:
+            return None
+        now = self._clock()
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.add(now - start)
+        return now
+
+    def tick(self):
+        """Counts a frame for the frame rate"""
+        if self.enabled:
+            self._frame_times[self.frames % len(self._frame_times)] = self._clock()
+            self.frames += 1
+
+    @property
+    def fps(self):
+        """Frame rate over the last fps_window frames, None before two frames"""
+        count = min(self.frames, len(self._frame_times))
+        if count < 2:
+            return None
+        newest = self._frame_times[(self.frames - 1) % len(self._frame_times)]
+        oldest = self._frame_times[(self.frames - count) % len(self._frame_times)]
+        return (count - 1) / (newest - oldest) if newest > oldest else None
+
+    def stats(self, reset=False):
+        """Returns a snapshot of the frame rate and of the statistics of every stage, in ms
+
+        Arguments:
+            reset (bool): Start the histograms over, e.g. to display the last second only
+        """
+        stats = {
+            'enabled': self.enabled,
+            'frames': self.frames,
+            'fps': self.fps,
+            'stages': {stage: histogram.to_dict() for stage, histogram in list(self.histograms.items())},
+        }
+        if reset:
+            self.histograms = {}
+        return stats
+
+    def reset(self):
+        """Forgets every duration and frame"""
+        self.histograms = {}
+        self.frames = 0
+        self._frame_times = [None] * len(self._frame_times)
+
+
+# Used by the classes given no instrumentation, never enabled
+DISABLED = Instrumentation()
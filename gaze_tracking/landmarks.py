@@ -0,0 +1,213 @@
+from __future__ import division
+import os
+import cv2
+import dlib
+import numpy as np
+
+from .face_tracker import FaceTracker
+
+
+class LandmarkBackend(object):
+    """
+    Base class of the face models GazeTracking can get its landmarks from.
+    A backend finds the faces of a frame and returns their landmarks, and
+    tells which landmarks outline the eyes, which ones are used for the head
+    pose and, if the model has them, which ones are the iris centers.
+
+    The eye points follow the order of the 68 Multi-PIE landmarks: outer
+    corner, two upper points, inner corner, two lower points.
+    """
+
+    LEFT_EYE_POINTS = None
+    RIGHT_EYE_POINTS = None
+    # Nose tip, chin, left eye left corner, right eye right corner,
+    # left mouth corner and right mouth corner, see HeadPoseEstimator.MODEL_POINTS
+    HEAD_POSE_POINTS = None
+    # (left iris center, right iris center), None if the pupils must be found by thresholding
+    IRIS_POINTS = None
+
+    def __init__(self, max_faces=1):
+        """
+        Arguments:
+            max_faces (int): Maximal number of faces returned for a frame
+        """
+        self.max_faces = max_faces
+
+    def detect(self, frame, gray):
+        """Returns the faces of the frame as a list of (track id, raw landmarks
+        of the model, (n, 2) int32 landmark array), sorted by track id
+
+        Arguments:
+            frame (numpy.ndarray): BGR frame
+            gray (numpy.ndarray): The same frame in grayscale
+        """
+        raise NotImplementedError
+
+    def active_tracks(self):
+        """Returns the track ids still followed, the state of the other faces can be dropped"""
+        raise NotImplementedError
+
+    def reset(self):
+        """Forgets every tracked face"""
+
+    def stats(self):
+        """Returns counters about the work of the backend"""
+        return {}
+
+
+class DlibBackend(LandmarkBackend):
+    """
+    HOG face detector and 68 points shape predictor of dlib. A FaceTracker
+    avoids running the detector on every frame.
+    """
+
+    LEFT_EYE_POINTS = [36, 37, 38, 39, 40, 41]
+    RIGHT_EYE_POINTS = [42, 43, 44, 45, 46, 47]
+    HEAD_POSE_POINTS = [33, 8, 36, 45, 48, 54]
+
+    def __init__(self, max_faces=1, redetect_interval=10, tracking_fallback="roi", detection_scale=1.0,
+                 model_path=None):
+        """
+        Arguments:
+            max_faces (int): Maximal number of faces tracked at once
+            redetect_interval (int): Number of frames the faces are tracked from their landmarks
+                before a full detection is forced (0 detects the faces on every frame)
+            tracking_fallback (str): "roi" or "full", where to search again when a track is lost
+            detection_scale (float): Size factor of the image given to the face detector,
+                landmarks are still predicted at full resolution
+            model_path (str): Shape predictor model, the one in trained_models if None
+        """
+        super(DlibBackend, self).__init__(max_faces)
+
+        # _face_detector is used to detect faces
+        self._face_detector = dlib.get_frontal_face_detector()
+
+        # _face_tracker avoids running _face_detector on every frame
+        self._face_tracker = FaceTracker(self._face_detector, redetect_interval=redetect_interval,
+                                         fallback=tracking_fallback, detection_scale=detection_scale,
+                                         max_faces=max_faces)
+
+        # _predictor is used to get facial landmarks of a given face
+        if model_path is None:
+            cwd = os.path.abspath(os.path.dirname(__file__))
+            model_path = os.path.abspath(os.path.join(cwd, "trained_models/shape_predictor_68_face_landmarks.dat"))
+        self._predictor = dlib.shape_predictor(model_path)
+
+    @staticmethod
+    def landmarks_to_array(shape):
+        """Converts the landmarks found by the predictor to an (n, 2) int32 array
+
+        Arguments:
+            shape (dlib.full_object_detection): Facial landmarks for the face region
+        """
+        return np.array([(p.x, p.y) for p in shape.parts()], dtype=np.int32)
+
+    def detect(self, frame, gray):
+        detected = []
+        for track_id, face in self._face_tracker.locate(gray):
+            # The predictor runs once per face, every consumer reads this array
+            shape = self._predictor(gray, face)
+            landmarks = self.landmarks_to_array(shape)
+            # Landmarks placed where the face no longer is are not analyzed
+            if self._face_tracker.refine(track_id, landmarks, gray):
+                detected.append((track_id, shape, landmarks))
+        return detected
+
+    def active_tracks(self):
+        return set(self._face_tracker.tracks)
+
+    def reset(self):
+        self._face_tracker.reset()
+
+    def stats(self):
+        """Returns how often the face detector had to run, see FaceTracker.stats"""
+        return self._face_tracker.stats()
+
+
+class MediaPipeBackend(LandmarkBackend):
+    """
+    MediaPipe FaceMesh with refined landmarks: 478 points including the
+    iris centers, so the pupils are given by the model and the threshold
+    based Pupil detection and its calibration are skipped. FaceMesh tracks
+    the faces itself, track ids are kept by box overlap between frames.
+    """
+
+    LEFT_EYE_POINTS = [33, 160, 158, 133, 153, 144]
+    RIGHT_EYE_POINTS = [362, 385, 387, 263, 373, 380]
+    HEAD_POSE_POINTS = [1, 152, 33, 263, 61, 291]
+    IRIS_POINTS = (468, 473)
+
+    def __init__(self, max_faces=1, min_detection_confidence=0.5, min_tracking_confidence=0.5):
+        """
+        Arguments:
+            max_faces (int): Maximal number of faces returned for a frame
+            min_detection_confidence (float): See mediapipe FaceMesh
+            min_tracking_confidence (float): See mediapipe FaceMesh
+        """
+        super(MediaPipeBackend, self).__init__(max_faces)
+
+        # Only needed by this backend
+        import mediapipe as mp
+        self._face_mesh = mp.solutions.face_mesh.FaceMesh(
+            max_num_faces=max_faces,
+            refine_landmarks=True,
+            min_detection_confidence=min_detection_confidence,
+            min_tracking_confidence=min_tracking_confidence
+        )
+        self._boxes = {}
+        self._next_id = 0
+        self.nb_frames = 0
+        self.nb_faces = 0
+
+    def _track_ids(self, boxes):
+        """Gives each face the id of the face of the previous frame it overlaps the most"""
+        if self.max_faces == 1:
+            return [0] * len(boxes)
+
+        previous = dict(self._boxes)
+        track_ids = []
+        for box in boxes:
+            overlaps = [(FaceTracker.iou(box, old_box), track_id) for track_id, old_box in previous.items()]
+            overlap, track_id = max(overlaps) if overlaps else (0, None)
+            if overlap > 0:
+                del previous[track_id]
+            else:
+                track_id = self._next_id
+                self._next_id += 1
+            track_ids.append(track_id)
+        return track_ids
+
+    def detect(self, frame, gray):
+        self.nb_frames += 1
+        height, width = frame.shape[:2]
+        results = self._face_mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        faces = results.multi_face_landmarks or []
+
+        scale = np.array([width, height], dtype=np.float64)
+        arrays = [(np.array([(point.x, point.y) for point in face.landmark]) * scale).astype(np.int32)
+                  for face in faces]
+        boxes = [np.concatenate((landmarks.min(axis=0), landmarks.max(axis=0))).astype(np.float64)
+                 for landmarks in arrays]
+
+        track_ids = self._track_ids(boxes)
+        self._boxes = dict(zip(track_ids, boxes))
+        self.nb_faces += len(faces)
+        return sorted(zip(track_ids, faces, arrays), key=lambda face: face[0])
+
+    def active_tracks(self):
+        return set(self._boxes)
+
+    def reset(self):
+        self._boxes = {}
+
+    def stats(self):
+        return {
+            'frames': self.nb_frames,
+            'faces': self.nb_faces,
+        }
+
+
+BACKENDS = {
+    "dlib": DlibBackend,
+    "mediapipe": MediaPipeBackend,
+}
@@ -0,0 +1,167 @@
+import json
+import os
+import struct
+import threading
+import time
+
+
+def _to_json(value):
+    """json.dumps fallback for numpy scalars and arrays"""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError("{} is not JSON serializable".format(type(value).__name__))
+
+
+class LogSink(object):
+    """
+    This class persists the anomaly events of an EventBus while the session
+    runs. A background thread reads the bus through its own subscription and
+    appends the events to the log file in batches, so the capture loop never
+    waits for the disk and a crash only loses the last batch.
+
+    Formats:
+        jsonl: one JSON object per line, see AnomalyEvent.to_dict
+        binary: for each event a fixed header (RECORD_HEADER: seq, frame,
+            monotonic timestamp, wall time, case code, face id or -1, info size)
+            followed by the info as JSON
+    """
+
+    FORMATS = ("jsonl", "binary")
+    RECORD_HEADER = struct.Struct('<qqddBiI')
+
+    def __init__(self, bus, path="logs/log.jsonl", fmt="jsonl", batch_size=64, flush_interval=1.0,
+                 max_bytes=10 * 1024 * 1024, backup_count=5):
+        """
+        Arguments:
+            bus (events.EventBus): Bus to read the events from
+            path (str): Log file, events are appended to it
+            fmt (str): "jsonl" or "binary"
+            batch_size (int): Number of pending events that triggers a write
+            flush_interval (float): Maximal time in seconds an event waits before being written
+            max_bytes (int): Size above which the file is rotated, 0 never rotates
+            backup_count (int): Number of rotated files kept (path.1, path.2...)
+        """
+        if fmt not in self.FORMATS:
+            raise ValueError("fmt must be one of {}".format(self.FORMATS))
+
+        self.path = path
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+        self._subscription = bus.subscribe()
+        self._stop = threading.Event()
+        self._thread = None
+        self._file = None
+
+        self.events_written = 0
+        self.bytes_written = 0
+        self.batches = 0
+        self.rotations = 0
+        self._write_time = 0.0
+
+    def start(self):
+        """Starts the writer thread"""
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._open()
+        self._thread = threading.Thread(target=self._run, name="LogSink", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Writes the remaining events and stops the writer thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._subscription.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _open(self):
+        mode = 'ab' if self.fmt == "binary" else 'a'
+        self._file = open(self.path, mode)
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while not self._stop.is_set():
+            pending = self._subscription.pending()
+            if pending >= self.batch_size or (pending and time.monotonic() - last_flush >= self.flush_interval):
+                self._write(self._subscription.poll())
+                last_flush = time.monotonic()
+            else:
+                self._stop.wait(min(self.flush_interval, 0.05))
+
+        self._write(self._subscription.poll())
+        self._file.close()
+
+    def _encode(self, event):
+        if self.fmt == "jsonl":
+            return json.dumps(event.to_dict(), default=_to_json) + '\n'
+        info = json.dumps(event.info, default=_to_json).encode('utf-8')
+        header = self.RECORD_HEADER.pack(event.seq, event.frame or 0, event.timestamp or 0.0,
+                                         event.wall_time, int(event.case),
+                                         -1 if event.face is None else event.face, len(info))
+        return header + info
+
+    def _write(self, events):
+        if not events:
+            return
+        start = time.perf_counter()
+        data = ('' if self.fmt == "jsonl" else b'').join(self._encode(event) for event in events)
+        self._file.write(data)
+        self._file.flush()
+
+        self.events_written += len(events)
+        self.bytes_written += len(data)
+        self.batches += 1
+        self._write_time += time.perf_counter() - start
+
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        """Renames path to path.1, path.1 to path.2... and opens a new file"""
+        self._file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = "{}.{}".format(self.path, index)
+            if os.path.exists(source):
+                os.replace(source, "{}.{}".format(self.path, index + 1))
+        if self.backup_count > 0:
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self.rotations += 1
+        self._open()
+
+    def stats(self):
+        """Returns the number of events waiting to be written and the write throughput"""
+        return {
+            'queue_depth': self._subscription.pending(),
+            'dropped': self._subscription.dropped,
+            'events_written': self.events_written,
+            'bytes_written': self.bytes_written,
+            'batches': self.batches,
+            'rotations': self.rotations,
+            'events_per_second': self.events_written / self._write_time if self._write_time else 0.0,
+        }
+
+    @classmethod
+    def read_binary(cls, path):
+        """Yields (seq, frame, timestamp, wall_time, case, face, info) tuples from a binary log"""
+        with open(path, 'rb') as file:
+            while True:
+                header = file.read(cls.RECORD_HEADER.size)
+                if len(header) < cls.RECORD_HEADER.size:
+                    return
+                seq, frame, timestamp, wall_time, case, face, size = cls.RECORD_HEADER.unpack(header)
+                info = json.loads(file.read(size).decode('utf-8'))
+                yield seq, frame, timestamp, wall_time, case, None if face < 0 else face, info
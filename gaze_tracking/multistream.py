@@ -0,0 +1,199 @@
+from __future__ import division
+import multiprocessing
+import queue
+import time
+from collections import namedtuple
+
+StreamMessage = namedtuple('StreamMessage', ['stream', 'kind', 'payload'])
+
+
+def _run_worker(assigned, gaze_options, width, output, stop):
+    """Body of a worker process: owns a GazeTracking and a FrameCapture per stream
+    and sends the metrics and the anomaly events of every frame to the parent.
+    Every stream ends with a 'done' message, preceded by an 'error' one when it failed.
+
+    Arguments:
+        assigned (list): (stream id, source) pairs handled by this worker
+        gaze_options (dict): Keyword arguments of GazeTracking
+        width (int): Frames are resized to this width before the analysis, if set
+        output (multiprocessing.Queue): Messages to the parent
+        stop (multiprocessing.Event): Set by the parent to stop the worker
+    """
+    pending = set(stream_id for stream_id, _ in assigned)
+    streams = {}
+
+    def end(stream_id, error=None):
+        if error is not None:
+            output.put(StreamMessage(stream_id, 'error', repr(error)))
+        capture = streams.pop(stream_id, (None,))[0]
+        stats = None
+        if capture is not None:
+            capture.stop()
+            stats = capture.stats()
+        pending.discard(stream_id)
+        output.put(StreamMessage(stream_id, 'done', stats))
+
+    try:
+        # Imported here so that the dlib models are only loaded in the workers
+        import imutils
+        from .gaze_tracking import GazeTracking
+        from .capture import FrameCapture
+
+        for stream_id, source in assigned:
+            capture = None
+            try:
+                capture = FrameCapture(source).start()
+                gaze = GazeTracking(headless=True, **gaze_options)
+            except Exception as error:
+                if capture is not None:
+                    capture.stop()
+                end(stream_id, error)
+                continue
+            streams[stream_id] = (capture, gaze, gaze.events.subscribe())
+
+        while streams and not stop.is_set():
+            processed = 0
+            for stream_id, (capture, gaze, events) in list(streams.items()):
+                try:
+                    captured = capture.read(timeout=0 if len(streams) > 1 else 0.1)
+                    if captured is None:
+                        if not capture.running:
+                            end(stream_id)
+                        continue
+                except Exception as error:
+                    end(stream_id, error)
+                    continue
+
+                # A frame that fails is reported, the stream goes on with the next one
+                try:
+                    frame = captured.frame
+                    if width:
+                        frame = imutils.resize(frame, width=width)
+                    gaze.refresh(frame, captured.timestamp)
+
+                    metrics = gaze.metrics()
+                    metrics['seq'] = captured.seq
+                    output.put(StreamMessage(stream_id, 'result', metrics))
+                    for event in events.poll():
+                        output.put(StreamMessage(stream_id, 'event', event.to_dict()))
+                except Exception as error:
+                    output.put(StreamMessage(stream_id, 'error', repr(error)))
+                    continue
+                processed += 1
+
+            if not processed:
+                time.sleep(0.001)
+    except Exception as error:
+        for stream_id in sorted(pending):
+            output.put(StreamMessage(stream_id, 'error', repr(error)))
+    finally:
+        for stream_id in sorted(pending):
+            end(stream_id)
+
+
+class MultiStreamEngine(object):
+    """
+    This class tracks several video sources at once on a pool of worker
+    processes, so the Python-heavy parts of the analysis of each stream are
+    not serialized by the GIL. Every worker owns the GazeTracking state and
+    the dlib models of its streams. The metrics and the anomaly events of
+    all the streams come back through a single queue as StreamMessage tuples:
+        ('result', metrics of a frame), ('event', anomaly event as a dict),
+        ('error', message) and ('done', capture statistics) when a stream ends
+    """
+
+    def __init__(self, sources, workers=None, width=None, queue_size=1024, **gaze_options):
+        """
+        Arguments:
+            sources (list): Camera indices or video files, their position is the stream id
+            workers (int): Number of worker processes, one per CPU (at most one per stream) if None
+            width (int): Frames are resized to this width before the analysis, if set
+            queue_size (int): Capacity of the queue of messages to the parent
+            gaze_options: Keyword arguments given to every GazeTracking
+        """
+        self.sources = list(sources)
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.workers = max(1, min(workers, len(self.sources)))
+        self.width = width
+        self.gaze_options = gaze_options
+
+        self._output = multiprocessing.Queue(maxsize=queue_size)
+        self._stop = multiprocessing.Event()
+        self._processes = []
+        self._remaining = set()
+        self._started = None
+
+        self.nb_results = {stream: 0 for stream in range(len(self.sources))}
+        self.nb_events = {stream: 0 for stream in range(len(self.sources))}
+
+    def start(self):
+        """Starts the worker processes, the streams are spread round-robin"""
+        self._started = time.monotonic()
+        self._remaining = set(range(len(self.sources)))
+        for index in range(self.workers):
+            assigned = [(stream, source) for stream, source in enumerate(self.sources)
+                        if stream % self.workers == index]
+            process = multiprocessing.Process(target=_run_worker, name="GazeWorker-{}".format(index),
+                                              args=(assigned, self.gaze_options, self.width,
+                                                    self._output, self._stop), daemon=True)
+            process.start()
+            self._processes.append(process)
+        return self
+
+    def stop(self):
+        """Stops the workers, the messages not read yet are discarded"""
+        self._stop.set()
+        for process in self._processes:
+            while process.is_alive():
+                self._discard()
+                process.join(0.05)
+        self._processes = []
+
+    def _discard(self):
+        try:
+            while True:
+                self._output.get_nowait()
+        except queue.Empty:
+            pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def get(self, timeout=None):
+        """Returns the next StreamMessage of any stream, or None on timeout"""
+        try:
+            message = self._output.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+        if message.kind == 'result':
+            self.nb_results[message.stream] += 1
+        elif message.kind == 'event':
+            self.nb_events[message.stream] += 1
+        elif message.kind == 'done':
+            self._remaining.discard(message.stream)
+        return message
+
+    def messages(self):
+        """Yields the StreamMessages until every stream has ended"""
+        while self._remaining:
+            message = self.get(timeout=0.5)
+            if message is not None:
+                yield message
+            elif not any(process.is_alive() for process in self._processes):
+                return
+
+    def stats(self):
+        """Returns the number of frames analyzed per stream and the overall frames per second"""
+        elapsed = time.monotonic() - self._started if self._started else 0
+        total = sum(self.nb_results.values())
+        return {
+            'workers': self.workers,
+            'results': dict(self.nb_results),
+            'events': dict(self.nb_events),
+            'fps': total / elapsed if elapsed else 0.0,
+        }
@@ -0,0 +1,188 @@
+from __future__ import division
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+PipelineResult = namedtuple('PipelineResult', ['seq', 'timestamp', 'frame', 'metrics', 'latency', 'error'])
+
+_STOP = object()
+
+
+class GazePipeline(object):
+    """
+    This class runs GazeTracking as three stages connected by bounded queues,
+    each one in its own thread:
+        detect: grayscale conversion, face detection and landmarks
+        analyze: eyes, pupils, head pose and statistics
+        render: drawing of the annotations on a copy of the frame, if there are any
+
+    While frame N is analyzed, frame N+1 is already in detection and frame
+    N-1 is being drawn. Every stage has a single worker, so the results come
+    out in the order the frames went in.
+    """
+
+    STAGES = ("detect", "analyze", "render")
+
+    def __init__(self, gaze, render=None, queue_size=2, history=500):
+        """
+        Arguments:
+            gaze (GazeTracking): Tracker to run, it must not be refreshed elsewhere meanwhile
+            render (bool): Draw the annotated frame, otherwise the results hold the original frame.
+                Defaults to True unless the tracker is headless.
+            queue_size (int): Capacity of each queue between two stages
+            history (int): Number of recent latencies kept for the statistics
+        """
+        self.gaze = gaze
+        self.render = not gaze.headless if render is None else render
+
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(len(self.STAGES) + 1)]
+        self._functions = (self._detect, self._analyze, self._render)
+        self._threads = []
+        self._seq = 0
+
+        self._latencies = {name: deque(maxlen=history) for name in self.STAGES + ("total",)}
+        self._started = None
+        self.nb_results = 0
+
+    def start(self):
+        """Starts the stage workers"""
+        self._started = time.monotonic()
+        for index, name in enumerate(self.STAGES):
+            thread = threading.Thread(target=self._work, args=(index,), name="GazePipeline-" + name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        """Stops the workers once the frames already submitted went through,
+        the results that were not read are discarded
+        """
+        while True:
+            try:
+                self._queues[0].put(_STOP, timeout=0.05)
+                break
+            except queue.Full:
+                self._drain()
+        for thread in self._threads:
+            while thread.is_alive():
+                self._drain()
+                thread.join(0.05)
+        self._threads = []
+        self._drain()
+
+    def _drain(self):
+        """Discards the results waiting at the end of the pipeline"""
+        try:
+            while True:
+                self._queues[-1].get_nowait()
+        except queue.Empty:
+            pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def submit(self, frame, timestamp=None, block=True):
+        """Sends a frame into the pipeline. Returns its sequence number,
+        or None if the pipeline is full and block is False.
+
+        Arguments:
+            frame (numpy.ndarray): BGR frame
+            timestamp (float): Capture time of the frame (time.monotonic), now if None
+            block (bool): Wait for room in the first queue
+        """
+        item = {
+            'seq': self._seq,
+            'frame': frame,
+            'timestamp': time.monotonic() if timestamp is None else timestamp,
+            'submitted': time.perf_counter(),
+            'latency': {},
+        }
+        try:
+            self._queues[0].put(item, block=block)
+        except queue.Full:
+            return None
+        self._seq += 1
+        return item['seq']
+
+    def get(self, timeout=None):
+        """Returns the next PipelineResult, in submission order, or None on timeout
+        or once the pipeline is stopped
+
+        Arguments:
+            timeout (float): Maximal waiting time in seconds, None waits forever
+        """
+        try:
+            item = self._queues[-1].get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if item is _STOP:
+            self._queues[-1].put(_STOP)
+            return None
+
+        total = time.perf_counter() - item['submitted']
+        self._latencies["total"].append(total)
+        item['latency']["total"] = total
+        self.nb_results += 1
+        return PipelineResult(item['seq'], item['timestamp'], item['frame'], item.get('metrics'),
+                              item['latency'], item.get('error'))
+
+    def _work(self, index):
+        name = self.STAGES[index]
+        function = self._functions[index]
+        source, destination = self._queues[index], self._queues[index + 1]
+
+        while True:
+            item = source.get()
+            if item is _STOP:
+                destination.put(_STOP)
+                return
+
+            start = time.perf_counter()
+            if 'error' not in item:
+                try:
+                    function(item)
+                except Exception as error:
+                    # The frame still goes through, so the order and the stop signal are kept
+                    item['error'] = error
+            duration = time.perf_counter() - start
+
+            self._latencies[name].append(duration)
+            item['latency'][name] = duration
+            destination.put(item)
+
+    def _detect(self, item):
+        item['detection'] = self.gaze._detect(item['frame'])
+
+    def _analyze(self, item):
+        self.gaze.refresh(item['frame'], item['timestamp'], item.pop('detection'))
+        item['metrics'] = self.gaze.metrics()
+        item['overlay'] = self.gaze.overlay() if self.render else None
+
+    def _render(self, item):
+        overlay = item.pop('overlay', None)
+        if self.render and overlay is not None:
+            frame = item['frame'].copy()
+            self.gaze.draw_overlay(frame, overlay)
+            item['frame'] = frame
+
+    def stats(self):
+        """Returns the mean and 95th percentile latency of every stage in milliseconds,
+        and the number of results per second since the start
+        """
+        stats = {}
+        for name, latencies in self._latencies.items():
+            values = np.array(tuple(latencies)) * 1000
+            stats[name] = {
+                'mean_ms': float(values.mean()) if len(values) else None,
+                'p95_ms': float(np.percentile(values, 95)) if len(values) else None,
+            }
+        elapsed = time.monotonic() - self._started if self._started else 0
+        stats['throughput_fps'] = self.nb_results / elapsed if elapsed else 0.0
+        stats['queued'] = [q.qsize() for q in self._queues]
+        return stats
@@ -0,0 +1,82 @@
+import json
+import os
+import time
+
+
+class CalibrationProfiles(object):
+    """
+    This class stores completed calibrations on disk, so that a new session
+    for the same user and camera starts calibrated on the first frame.
+    Profiles are kept in a single JSON file, indexed by a user or camera key.
+    """
+
+    def __init__(self, path="profiles/calibration.json"):
+        """
+        Arguments:
+            path (str): JSON file holding the profiles, created on the first save
+        """
+        self.path = path
+
+    def _read(self):
+        """Returns every stored profile"""
+        try:
+            with open(self.path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def load(self, key, resolution=None):
+        """Returns the profile saved for the key, or None if there is no profile
+        or if it was recorded at another resolution.
+
+        Arguments:
+            key (str): User or camera key
+            resolution (tuple): (width, height) of the analyzed frames, not checked if None
+        """
+        profile = self._read().get(key)
+        if profile is None:
+            return None
+        if resolution is not None and tuple(profile['resolution']) != tuple(resolution):
+            return None
+        return profile
+
+    def save(self, key, calibration, resolution):
+        """Saves a completed calibration for the key, replacing the former one
+
+        Arguments:
+            key (str): User or camera key
+            calibration (calibration.Calibration): Completed calibration
+            resolution (tuple): (width, height) of the frames it was computed on
+        """
+        if not calibration.is_complete():
+            raise ValueError("Only a completed calibration can be saved")
+
+        profiles = self._read()
+        profiles[key] = {
+            'resolution': [int(resolution[0]), int(resolution[1])],
+            'thresholds_left': calibration.thresholds_left[-calibration.nb_frames:],
+            'thresholds_right': calibration.thresholds_right[-calibration.nb_frames:],
+            'threshold_left': calibration.threshold(0),
+            'threshold_right': calibration.threshold(1),
+            'updated': time.time(),
+        }
+
+        self._write(profiles)
+
+    def _write(self, profiles):
+        """Replaces the stored profiles"""
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # Written next to the store then renamed, so a crash never leaves a truncated file
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump(profiles, file, indent=2)
+        os.replace(temporary_path, self.path)
+
+    def delete(self, key):
+        """Removes the profile of the key if there is one"""
+        profiles = self._read()
+        if profiles.pop(key, None) is not None:
+            self._write(profiles)
@@ -1,6 +1,8 @@
 import numpy as np
 import cv2
 
+from .instrumentation import DISABLED
+
 
 class Pupil(object):
     """
@@ -8,13 +10,43 @@ class Pupil(object):
     the position of the pupil
     """
 
-    def __init__(self, eye_frame, threshold):
+    def __init__(self, eye_frame, threshold, instrumentation=None):
         self.iris_frame = None
         self.threshold = threshold
         self.x = None
         self.y = None
 
-        self.detect_iris(eye_frame)
+        self.detect_iris(eye_frame, instrumentation or DISABLED)
+
+    @classmethod
+    def from_center(cls, x, y):
+        """Returns a Pupil whose position was given by a landmark model
+
+        Arguments:
+            x (int): Position of the iris center in the eye frame
+            y (int): Position of the iris center in the eye frame
+        """
+        pupil = cls.__new__(cls)
+        pupil.iris_frame = None
+        pupil.threshold = None
+        pupil.x = x
+        pupil.y = y
+        return pupil
+
+    @staticmethod
+    def smoothing(eye_frame):
+        """Performs the threshold-independent part of the iris isolation:
+        denoising while keeping edges, then eroding
+
+        Arguments:
+            eye_frame (numpy.ndarray): Frame containing an eye and nothing else
+
+        Returns:
+            The filtered frame, ready to be binarized
+        """
+        kernel = np.ones((3, 3), np.uint8)
+        new_frame = cv2.bilateralFilter(eye_frame, 10, 15, 15)
+        return cv2.erode(new_frame, kernel, iterations=3)
 
     @staticmethod
     def image_processing(eye_frame, threshold):
@@ -27,24 +59,26 @@ class Pupil(object):
         Returns:
             A frame with a single element representing the iris
         """
-        kernel = np.ones((3, 3), np.uint8)
-        new_frame = cv2.bilateralFilter(eye_frame, 10, 15, 15)
-        new_frame = cv2.erode(new_frame, kernel, iterations=3)
+        new_frame = Pupil.smoothing(eye_frame)
         new_frame = cv2.threshold(new_frame, threshold, 255, cv2.THRESH_BINARY)[1]
 
         return new_frame
 
-    def detect_iris(self, eye_frame):
+    def detect_iris(self, eye_frame, timer=DISABLED):
         """Detects the iris and estimates the position of the iris by
         calculating the centroid.
 
         Arguments:
             eye_frame (numpy.ndarray): Frame containing an eye and nothing else
+            timer (instrumentation.Instrumentation): Times the filtering and contour stages
         """
+        start = timer.clock()
         self.iris_frame = self.image_processing(eye_frame, self.threshold)
+        start = timer.record('iris_filter', start)
 
         contours, _ = cv2.findContours(self.iris_frame, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)[-2:]
         contours = sorted(contours, key=cv2.contourArea)
+        timer.record('iris_contours', start)
 
         try:
             moments = cv2.moments(contours[-2])
@@ -0,0 +1,111 @@
+from __future__ import division
+import numpy as np
+
+
+class RunningStatistics(object):
+    """
+    This class keeps the mean and the variance of several metrics in one
+    float64 vector and updates all of them at once on every frame.
+
+    Three modes are available:
+        cumulative: mean and variance of every sample since the reset (Welford)
+        ewma: exponentially weighted mean and variance, recent samples weigh more
+        window: mean and variance of the last `window` samples
+
+    Missing metrics are passed as NaN and left untouched.
+    """
+
+    MODES = ("cumulative", "ewma", "window")
+
+    def __init__(self, size, mode="cumulative", alpha=0.05, window=300):
+        """
+        Arguments:
+            size (int): Number of metrics
+            mode (str): "cumulative", "ewma" or "window"
+            alpha (float): Weight of a new sample in ewma mode
+            window (int): Number of samples kept in window mode
+        """
+        if mode not in self.MODES:
+            raise ValueError("mode must be one of {}".format(self.MODES))
+
+        self.size = size
+        self.mode = mode
+        self.alpha = alpha
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        """Forgets every sample"""
+        self.count = np.zeros(self.size, dtype=np.int64)
+        self.mean = np.zeros(self.size, dtype=np.float64)
+        self._m2 = np.zeros(self.size, dtype=np.float64)
+
+        if self.mode == "window":
+            self._buffer = np.full((self.window, self.size), np.nan, dtype=np.float64)
+            self._index = 0
+            self._sum = np.zeros(self.size, dtype=np.float64)
+            self._sum_squares = np.zeros(self.size, dtype=np.float64)
+
+    @property
+    def variance(self):
+        """Variance of every metric (0 while there are less than two samples)"""
+        if self.mode == "cumulative":
+            return np.divide(self._m2, self.count - 1, out=np.zeros(self.size), where=self.count > 1)
+        if self.mode == "ewma":
+            return self._m2.copy()
+        mean_squares = np.divide(self._sum_squares, self.count, out=np.zeros(self.size), where=self.count > 0)
+        return np.maximum(mean_squares - self.mean ** 2, 0)
+
+    @property
+    def std(self):
+        """Standard deviation of every metric"""
+        return np.sqrt(self.variance)
+
+    def update(self, values):
+        """Adds one sample of every metric and returns the absolute deviations
+        of the sample from the updated means.
+
+        Arguments:
+            values (numpy.ndarray): One value per metric, NaN when it is missing
+        """
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        sample = np.where(valid, values, 0.0)
+
+        if self.mode == "cumulative":
+            self.count += valid
+            delta = np.where(valid, sample - self.mean, 0.0)
+            self.mean += np.divide(delta, self.count, out=np.zeros(self.size), where=valid)
+            self._m2 += delta * np.where(valid, sample - self.mean, 0.0)
+
+        elif self.mode == "ewma":
+            first = valid & (self.count == 0)
+            self.count += valid
+            delta = np.where(valid, sample - self.mean, 0.0)
+            self.mean += self.alpha * delta
+            self._m2 = np.where(valid, (1 - self.alpha) * (self._m2 + self.alpha * delta ** 2), self._m2)
+            self.mean[first] = sample[first]
+            self._m2[first] = 0.0
+
+        else:
+            old = self._buffer[self._index]
+            old_valid = ~np.isnan(old)
+            old = np.where(old_valid, old, 0.0)
+            self._sum += sample - old
+            self._sum_squares += sample ** 2 - old ** 2
+            self.count += valid.astype(np.int64) - old_valid
+            self._buffer[self._index] = values
+            self._index = (self._index + 1) % self.window
+            self.mean = np.divide(self._sum, self.count, out=np.zeros(self.size), where=self.count > 0)
+
+        return np.abs(values - self.mean)
+
+    def zscores(self, values):
+        """Returns how many standard deviations every value is from its mean (NaN if unknown)
+
+        Arguments:
+            values (numpy.ndarray): One value per metric
+        """
+        std = self.std
+        return np.divide(np.abs(np.asarray(values, dtype=np.float64) - self.mean), std,
+                         out=np.full(self.size, np.nan), where=std > 0)
@@ -0,0 +1,110 @@
+from __future__ import division
+import math
+import numpy as np
+
+
+class SaccadeDetector(object):
+    """
+    This class detects saccades with a velocity threshold (I-VT) on a
+    stream of gaze positions. Each sample is processed in constant time
+    and the recent samples are kept in a fixed-size ring buffer, so the
+    cost and the memory don't grow with the length of the session.
+    """
+
+    def __init__(self, threshold=37, capacity=256):
+        """
+        Arguments:
+            threshold (float): Velocity in pixels per second above which the eyes are in a saccade
+            capacity (int): Number of recent samples kept in the ring buffer
+        """
+        self.threshold = threshold
+        self.capacity = capacity
+
+        # Columns: timestamp, x, y, velocity
+        self._samples = np.zeros((capacity, 4), dtype=np.float64)
+        self._index = 0
+        self._count = 0
+
+        self.in_saccade = False
+        self.onset_time = None
+        self.onset_position = None
+        self.peak_velocity = 0.0
+        self.nb_saccades = 0
+
+    def __len__(self):
+        return self._count
+
+    def _last(self):
+        """Returns the last recorded sample"""
+        return self._samples[(self._index - 1) % self.capacity]
+
+    def update(self, position, timestamp):
+        """Adds a gaze position and returns the saccade event it triggers, if any.
+
+        Arguments:
+            position (tuple): (x, y) gaze position in pixels
+            timestamp (float): Time of the sample in seconds (monotonic clock)
+
+        Returns:
+            None, or a dict with the 'phase' ("onset" or "offset") of the saccade
+        """
+        velocity = 0.0
+        if self._count:
+            last = self._last()
+            elapsed = float(timestamp - last[0])
+            if elapsed <= 0:
+                return None
+            velocity = math.hypot(position[0] - last[1], position[1] - last[2]) / elapsed
+
+        self._samples[self._index] = (timestamp, position[0], position[1], velocity)
+        self._index = (self._index + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+        if velocity > self.threshold:
+            self.peak_velocity = max(self.peak_velocity, velocity)
+            if not self.in_saccade:
+                self.in_saccade = True
+                self.onset_time = timestamp
+                self.onset_position = (position[0], position[1])
+                self.nb_saccades += 1
+                return {
+                    'phase': "onset",
+                    'timestamp': timestamp,
+                    'position': self.onset_position,
+                    'velocity': velocity,
+                }
+        elif self.in_saccade:
+            event = {
+                'phase': "offset",
+                'timestamp': timestamp,
+                'position': (position[0], position[1]),
+                'onset_position': self.onset_position,
+                'duration': timestamp - self.onset_time,
+                'amplitude': math.hypot(position[0] - self.onset_position[0],
+                                        position[1] - self.onset_position[1]),
+                'peak_velocity': self.peak_velocity,
+            }
+            self.in_saccade = False
+            self.onset_time = None
+            self.onset_position = None
+            self.peak_velocity = 0.0
+            return event
+
+        return None
+
+    def recent(self):
+        """Returns the samples in the buffer, oldest first, as an (n, 4) array
+        of timestamp, x, y and velocity
+        """
+        if self._count < self.capacity:
+            return self._samples[:self._count].copy()
+        return np.roll(self._samples, -self._index, axis=0)
+
+    def reset(self):
+        """Forgets every sample, e.g. when the face is lost"""
+        self._index = 0
+        self._count = 0
+        self.in_saccade = False
+        self.onset_time = None
+        self.onset_position = None
+        self.peak_velocity = 0.0
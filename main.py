@@ -1,66 +1,138 @@
-import os
+import argparse
+import contextlib
 import pprint
+import time
 
 # TODO disabled unresolved references
 # TODO disabled duplicate
 
 import cv2
-from gaze_tracking import GazeTracking
+from gaze_tracking import GazeTracking, CalibrationProfiles, LogSink, FrameCapture, GazePipeline
 import imutils
 import mediapipe as mp
 from gaze_tracking import gaze as gz
 
-import time
-
 mp_face_mesh = mp.solutions.face_mesh  # initialize the face mesh model
 text = "Not Found"
 toggle_log = False
+toggle_stats = False
 
 if __name__ == "__main__":
-    gaze = GazeTracking()
-    webcam = cv2.VideoCapture(0)
-
-    with mp_face_mesh.FaceMesh(
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", nargs="?", default="0", help="camera index or video file")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="detect, analyze and draw consecutive frames in parallel")
+    parser.add_argument("--max-faces", type=int, default=1, help="number of faces tracked at once")
+    parser.add_argument("--backend", choices=("dlib", "mediapipe"), default="dlib",
+                        help="face landmark model used by the tracker")
+    parser.add_argument("--processing-width", type=int, default=None,
+                        help="frames wider than this are downscaled before the analysis (default: camera size)")
+    parser.add_argument("--display-width", type=int, default=1600, help="width of the displayed frames")
+    parser.add_argument("--profile", default=None,
+                        help="user or camera key of the stored calibration (default: webcam-<index> for a camera, "
+                             "none for a video file)")
+    args = parser.parse_args()
+
+    # Calibrations are stored per camera (or per user with --profile), a video file only reads one
+    camera = args.source.isdigit()
+    profile_key = args.profile or ("webcam-" + args.source if camera else None)
+    gaze = GazeTracking(profiles=CalibrationProfiles() if profile_key else None, profile_key=profile_key,
+                        max_faces=args.max_faces, backend=args.backend, processing_width=args.processing_width)
+    capture = FrameCapture(int(args.source) if camera else args.source).start()
+    pipeline = GazePipeline(gaze).start() if args.pipeline else None
+
+    # The overlay and the log file read the anomalies through their own cursor
+    overlay_events = gaze.events.subscribe()
+    log_sink = LogSink(gaze.events, path='logs/log.jsonl').start()
+    display = None
+    stats_lines = []
+    stats_time = 0
+    gaze_estimator = gz.GazeEstimator()  # keeps the head pose of the face between frames
+
+    # With the mediapipe backend the tracker's face mesh is reused for the gaze lines,
+    # otherwise a second face model runs on every frame
+    single_pass = args.backend == "mediapipe"
+    face_mesh_context = contextlib.nullcontext() if single_pass else mp_face_mesh.FaceMesh(
             max_num_faces=1,  # number of faces to track in each frame
             refine_landmarks=True,  # includes iris landmarks in the face mesh model
             min_detection_confidence=0.5,
             min_tracking_confidence=0.5
-    ) as face_mesh:
+    )
+
+    with face_mesh_context as face_mesh:
         while True:
-            # We get a new frame from the webcam
-            success, frame = webcam.read()
-            if not success:  # no frame input
-                print(text)
+            # We get the newest frame from the webcam
+            captured = capture.read()
+            if captured is None:
+                if not capture.running:  # no frame input
+                    print(text)
+                    break
+                continue
 
-            frame = imutils.resize(frame, width=1600)
+            # The frame is analyzed at the processing width and only resized for the display
+            frame = captured.frame
             frame.flags.writeable = False
 
-            if gaze.debug_mode:
+            if gaze.debug_mode and not single_pass:
                 frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)  # frame to RGB for the face-mesh model
                 results = face_mesh.process(frame)
                 frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)  # frame back to BGR for OpenCV
                 if results.multi_face_landmarks:
-                    gz.gaze(frame, results.multi_face_landmarks[0])  # gaze estimation
-
-            # We send this frame to GazeTracking to analyze it
-            gaze.refresh(frame)
-
-            frame = gaze.annotated_frame()
+                    gz.gaze(frame, results.multi_face_landmarks[0], gaze_estimator)  # gaze estimation
+
+            if pipeline is not None:
+                # The annotated frame comes out a few frames later
+                pipeline.submit(frame, captured.timestamp)
+                result = pipeline.get(timeout=0)
+                if result is None:
+                    continue
+                frame = imutils.resize(result.frame, width=args.display_width)
+            else:
+                # We send this frame to GazeTracking to analyze it
+                gaze.refresh(frame, captured.timestamp)
+
+                # The display buffer is reused from frame to frame
+                display = gaze.display_buffer(args.display_width, display)
+                frame = gaze.annotated_frame(out=display)
+
+                if gaze.debug_mode and single_pass and gaze.located_faces:
+                    # gaze estimation, the landmarks are in the pixels of the analyzed frame
+                    gaze_estimator.estimate(gaze.landmarks, gaze.processing_shape)
+                    gaze_estimator.draw(frame, scale=frame.shape[1] / gaze.processing_shape[1])
 
             # Display the log box
             if toggle_log:
+                if not frame.flags.writeable:  # frame left as captured, nothing was drawn
+                    frame = frame.copy()
                 queue_text = "Log: "
                 y0 = 90  # Starting y-coordinate for the first line
                 dy = 30  # Vertical spacing between lines
                 cv2.putText(frame, queue_text, (120, 60), cv2.FONT_HERSHEY_COMPLEX, 0.8, (147, 31, 58), 2)
 
-                if not gaze.anomaly_queue_log2.empty():
-                    recent_anomaly = pprint.pformat(gaze.anomaly_queue_log2.get())
+                event = overlay_events.get()
+                if event is not None:
+                    recent_anomaly = pprint.pformat(event.to_dict())
                     print(recent_anomaly)
                     for i, line in enumerate(recent_anomaly.split('\n')):
                         y = y0 + i * dy
                         cv2.putText(frame, line, (120, y), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 1)
 
+            # Display the frame rate and the median time of each stage over the last second
+            if toggle_stats:
+                if not frame.flags.writeable:
+                    frame = frame.copy()
+                now = time.monotonic()
+                if now - stats_time >= 1:
+                    stats_time = now
+                    stats = gaze.stats(reset=True)
+                    stats_lines = ["FPS: {:.1f}".format(stats['fps'] or 0),
+                                   "Dropped: {}".format(capture.stats()['dropped'])]
+                    stats_lines += ["{}: {:.2f} ms".format(stage, values['p50_ms'])
+                                    for stage, values in stats['stages'].items()]
+                x = frame.shape[1] - 320
+                for i, line in enumerate(stats_lines):
+                    cv2.putText(frame, line, (x, 60 + i * 25), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 1)
+
             cv2.imshow("PyGaze", frame)
 
             key = cv2.waitKey(1)
@@ -72,18 +144,19 @@ if __name__ == "__main__":
                         toggle_log = True
                     else:
                         toggle_log = False
+                case 112:
+                    toggle_stats = not toggle_stats
+                    gaze.instrumentation.reset()
+                    gaze.instrumentation.enabled = toggle_stats
+                    stats_lines = []
+                    stats_time = 0
                 case 27:
                     break
 
-    webcam.release()
+    if pipeline is not None:
+        pipeline.stop()
+    capture.stop()
     cv2.destroyAllWindows()
-
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
-
-    with open(f'logs/log.txt', 'w') as file:
-        # Iterate over the items in the queue and write them to the file
-        while not gaze.anomaly_queue_log.empty():
-            item = pprint.pformat(gaze.anomaly_queue_log2.get())
-            log_entry = f"{time.ctime(time.time())}: \n{item}\n\n"
-            file.write(log_entry)
+    if camera:
+        gaze.save_calibration()
+    log_sink.stop()
@@ -1,63 +1,62 @@
-import os
-import pprint
-
-from flask import Flask, render_template, Response
+from flask import Flask, render_template, Response, jsonify, request
 import cv2
-import imutils
-from gaze_tracking import GazeTracking
-import mediapipe as mp
-import time
+from gaze_tracking import GazeTracking, LogSink, FrameCapture, FrameBroadcaster, EventIndex
 
 app = Flask(__name__)
 gaze = GazeTracking()
-webcam = cv2.VideoCapture(0)
-mp_face_mesh = mp.solutions.face_mesh
+capture = FrameCapture(0).start()
+# Captures, analyzes and encodes every frame once for all the viewers
+broadcaster = FrameBroadcaster(gaze, capture).start()
+# Keeps the anomalies for the queries of /anomalies
+event_index = EventIndex(gaze.events).start()
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
-def generate_frames():
-    global webcam, gaze
-
-    with mp_face_mesh.FaceMesh(
-        max_num_faces=1,
-        refine_landmarks=True,
-        min_detection_confidence=0.5,
-        min_tracking_confidence=0.5
-    ) as face_mesh:
-        while True:
-            success, frame = webcam.read()
-            if not success:
-                break
-
-            frame = imutils.resize(frame, width=1600)
-            frame.flags.writeable = False
-
-            gaze.refresh(frame)
-            frame = gaze.annotated_frame()
-
-            ret, buffer = cv2.imencode('.jpg', frame)
-            frame = buffer.tobytes()
-
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-
 @app.route('/video_feed')
 def video_feed():
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return Response(broadcaster.stream(), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/metrics')
+def metrics():
+    # Gaze samples and anomalies as server-sent events, ?rate=10 for at most 10 samples per second
+    rate = request.args.get('rate', type=float)
+    events = request.args.get('events', default='1') != '0'
+    return Response(broadcaster.metrics_stream(rate=rate, events=events), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+@app.route('/anomalies')
+def anomalies():
+    # ?cursor=<next_cursor of the previous page>&case=saccade&case=head%20pose%20angle&since=&until=
+    #  &frame_from=&frame_to=&face=&limit=
+    try:
+        page = event_index.query(
+            cursor=request.args.get('cursor', type=int),
+            limit=min(request.args.get('limit', default=100, type=int), 1000),
+            cases=request.args.getlist('case') or None,
+            since=request.args.get('since', type=float),
+            until=request.args.get('until', type=float),
+            frame_from=request.args.get('frame_from', type=int),
+            frame_to=request.args.get('frame_to', type=int),
+            face=request.args.get('face', type=int),
+        )
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+    page['events'] = [dict(event.to_dict(), time=event.timestamp) for event in page['events']]
+    return jsonify(page)
+
+@app.route('/stats')
+def stats():
+    return jsonify(broadcaster.stats())
 
 if __name__ == "__main__":
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
-
-    with open(f'logs/log.txt', 'w') as file:
-        while not gaze.anomaly_queue_log.empty():
-            item = pprint.pformat(gaze.anomaly_queue_log2.get())
-            log_entry = f"{time.ctime(time.time())}: \n{item}\n\n"
-            file.write(log_entry)
-
-    app.run(debug=True, port=8080)
-
-webcam.release()
+    log_sink = LogSink(gaze.events, path='logs/log.jsonl').start()
+    # The reloader would run this module twice and open the camera twice
+    app.run(debug=True, use_reloader=False, port=8080)
+    log_sink.stop()
+
+event_index.stop()
+broadcaster.stop()
+capture.stop()
 cv2.destroyAllWindows()
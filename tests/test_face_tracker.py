@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+dlib = pytest.importorskip("dlib")
+
+from gaze_tracking.face_tracker import FaceTracker  # noqa: E402
+
+SHAPE = (480, 640)
+
+
+class BrightFaceDetector(object):
+    """Detector finding the bright rectangle drawn as a face, in the frame or the region given"""
+
+    def __init__(self):
+        self.nb_calls = 0
+
+    def __call__(self, image, upsample):
+        return self.run(image, upsample, 0)[0]
+
+    def run(self, image, upsample, adjust_threshold):
+        self.nb_calls += 1
+        points = np.argwhere(image > 0)
+        if not len(points):
+            return [], [], []
+        (top, left), (bottom, right) = points.min(axis=0), points.max(axis=0)
+        return [dlib.rectangle(int(left), int(top), int(right), int(bottom))], [1.0], [0]
+
+
+def face_frame(left, top, size=200):
+    frame = np.zeros(SHAPE, np.uint8)
+    frame[top:top + size, left:left + size] = 255
+    return frame
+
+
+def face_landmarks(left, top, size=200, eye_spacing=1.0):
+    """68 landmarks of a frontal face in its box, eye_spacing < 1 squeezes the face as when it turns"""
+    landmarks = np.empty((68, 2))
+    center = left + size / 2
+    landmarks[:] = (center, top + size * 0.6)
+    landmarks[0:17, 0] = center + np.linspace(-0.45, 0.45, 17) * size * eye_spacing
+    landmarks[0:17, 1] = top + size * (0.4 + 0.5 * np.sin(np.linspace(0, np.pi, 17)))
+    for first, eye_x in ((36, -0.2), (42, 0.2)):
+        angles = np.linspace(0, 2 * np.pi, 6, endpoint=False)
+        landmarks[first:first + 6, 0] = center + (eye_x + 0.06 * np.cos(angles)) * size * eye_spacing
+        landmarks[first:first + 6, 1] = top + size * (0.4 + 0.03 * np.sin(angles))
+    landmarks[27:36] = (center, top + size * 0.6)
+    landmarks[48:68, 0] = center + np.linspace(-0.15, 0.15, 20) * size * eye_spacing
+    landmarks[48:68, 1] = top + size * 0.75
+    return landmarks.astype(np.int32)
+
+
+def test_face_moving_slowly_stays_tracked():
+    detector = BrightFaceDetector()
+    tracker = FaceTracker(detector, redetect_interval=10)
+    for step in range(8):
+        frame = face_frame(200 + 2 * step, 100)
+        (track_id, _), = tracker.locate(frame)
+        assert tracker.refine(track_id, face_landmarks(200 + 2 * step, 100), frame)
+
+    stats = tracker.stats()
+    assert stats['full_detections'] == 1
+    assert stats['tracked'] == 7
+    assert stats['lost'] == 0
+
+
+def test_face_disappearing_between_redetects_is_lost():
+    detector = BrightFaceDetector()
+    tracker = FaceTracker(detector, redetect_interval=10)
+    for _ in range(2):
+        frame = face_frame(200, 100)
+        (track_id, _), = tracker.locate(frame)
+        assert tracker.refine(track_id, face_landmarks(200, 100), frame)
+
+    # The face is gone, the predictor still places a face in the tracked box
+    frame = np.zeros(SHAPE, np.uint8)
+    (track_id, _), = tracker.locate(frame)
+    assert tracker.stats()['full_detections'] == 1
+    assert not tracker.refine(track_id, face_landmarks(200, 100), frame)
+    assert tracker.tracks[track_id].lost
+
+    # Searched again on the next frame instead of being tracked
+    assert tracker.locate(frame) == []
+
+
+def test_face_turning_away_is_lost_without_verification():
+    detector = BrightFaceDetector()
+    tracker = FaceTracker(detector, redetect_interval=10, verify_interval=0)
+    frame = face_frame(200, 100)
+    (track_id, _), = tracker.locate(frame)
+    assert tracker.refine(track_id, face_landmarks(200, 100), frame)
+
+    (track_id, _), = tracker.locate(frame)
+    nb_calls = detector.nb_calls
+    assert not tracker.refine(track_id, face_landmarks(200, 100, eye_spacing=0.5), frame)
+    assert detector.nb_calls == nb_calls
+    assert tracker.tracks[track_id].lost